@@ -1,20 +1,26 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-# Setup logging
-import logging
-
+# Setup logging, levels are given by name so importing ocd doesn't import logging
 LOGGING_CONFIG = {'formatters': {'f': {'format': '%(asctime)s %(name)-12s %(levelname)-8s '
                                                  '%(message)s'}},
                   'handlers': {'h': {'class': 'logging.StreamHandler',
                                      'formatter': 'f',
-                                     'level': logging.DEBUG}},
-                  'root': {'handlers': ['h'], 'level': logging.DEBUG},
+                                     'level': 'DEBUG'}},
+                  'root': {'handlers': ['h'], 'level': 'INFO'},
                   'version': 1}
 # Define invalid characters and default rules
 INVALID_CHARACTERS = r'\/:*?"<>|'
-OPERATIONS = ['copy', 'move', 'delete', 'dryrun', 'rename']
+OPERATIONS = ['copy', 'move', 'delete', 'dryrun', 'rename', 'archive', 'extract', 'link', 'symlink']
 TARGETS = ['files','folders','both']
+COMPRESSIONS = ['none', 'gz', 'zst']
+ARCHIVE_SIZE = 256 * 1024 ** 2
+ARCHIVE_SUFFIXES = {'none': '.tar', 'gz': '.tar.gz', 'zst': '.tar.zst'}
+READ_ORDERS = ['none', 'inode', 'physical']
+DURABILITIES = ['none', 'file', 'batch']
+SYNC_BATCH = 256
+JOB_CONCURRENCY = 4
+DEVICE_CONCURRENCY = 1
 DEFAULT_RULES = {
     'logging': LOGGING_CONFIG,
     'characters': {' ': '_'},
@@ -0,0 +1,10 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+__main__.py
+Entry point for python -m ocd.
+"""
+import sys
+from ocd.cli import main
+
+sys.exit(main())
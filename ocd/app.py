@@ -4,26 +4,56 @@
 app.py
 Organize files based on type etc.
 """
-import argparse
+import errno
+import fnmatch
+import functools
 import logging
-import hashlib
+import os
 import json
-import shutil
-import string
-import random
-from ocd import INVALID_CHARACTERS, DEFAULT_RULES, LOGGING_CONFIG, OPERATIONS, TARGETS
-from logging.config import dictConfig
+import re
+import stat
+import time
+from ocd import INVALID_CHARACTERS, DEFAULT_RULES, OPERATIONS, TARGETS, COMPRESSIONS, \
+    ARCHIVE_SIZE, ARCHIVE_SUFFIXES, READ_ORDERS, DURABILITIES, SYNC_BATCH, JOB_CONCURRENCY, DEVICE_CONCURRENCY
+from ocd.metrics import stats, timed, path_size, result_count, paths_count
+from ocd.log import setup_logging, stop_logging, Progress, audit
+from ocd.parallel import run_concurrently
+from ocd.store import Entries, Plan, FILE, DIR, OTHER, entry_items, entry_kind
 from pathlib import Path
 
-try:
-    import xxhash
-except ImportError:
-    xxhash = None
-
-# Setup logging
-dictConfig(LOGGING_CONFIG)
+# Logging is configured from rules.json by run_jobs or the command line interface
 logger = logging.getLogger()
 
+# Threads creating destination folders up front
+MKDIR_WORKERS = 8
+
+# Files this large are hashed in parallel chunks
+HASH_CHUNK_SIZE = 16 * 1024 ** 2
+HASH_LARGE_FILE = 4 * HASH_CHUNK_SIZE
+HASH_WORKERS = min(8, os.cpu_count() or 1)
+
+# Threads syncing a batch of copies, parallel fsyncs share journal commits
+SYNC_WORKERS = 8
+
+
+@functools.lru_cache(maxsize=None)
+def _xxhash():
+    # Optional modules are only imported once an operation needs them
+    try:
+        import xxhash
+    except ImportError:
+        return None
+    return xxhash
+
+
+@functools.lru_cache(maxsize=None)
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
 
 def replace_characters(input_string: str, rules=None):
     """Replace characters based on table"""
@@ -45,10 +75,10 @@ def remove_characters(input_string: str):
     return ''.join(c for c in input_string if c not in INVALID_CHARACTERS)
 
 
-def clean_string(input_string):
+def clean_string(input_string, rules=None):
     """Fix a filename"""
     # Try and replace illegal characters
-    output_string = replace_characters(input_string)
+    output_string = replace_characters(input_string, rules)
 
     # Remove remaining illegal characters
     output_string = remove_characters(output_string)
@@ -76,11 +106,12 @@ def clean_string(input_string):
 #     return old_path, new_path
 
 
-def run_jobs(rules=None):
+def run_jobs(rules=None, cache=None):
     """Get jobs from rules
 
     Args:
         rules: dict with rules
+        cache: Cache kept between runs
 
     Returns:
         list: list of dicts with job info
@@ -89,9 +120,29 @@ def run_jobs(rules=None):
     if not rules:
         rules = get_rules()
     jobs = get_jobs(rules)
+    setup_logging(rules)
+    stats.configure(rules.get('metrics'))
 
-    for job in jobs:
-        run_job(**job)
+    limits = get_concurrency(rules)
+    if limits is None:
+        stop_logging()
+        return
+
+    # Jobs that don't share paths run concurrently
+    run_concurrently(jobs, lambda job: run_job(rules=rules, cache=cache, **job), *limits)
+
+    stats.report()
+    stop_logging()
+
+
+def get_concurrency(rules):
+    """Return the concurrency and device_concurrency of rules, None if they aren't whole numbers of 1 or more"""
+    limits = rules.get('concurrency', JOB_CONCURRENCY), rules.get('device_concurrency', DEVICE_CONCURRENCY)
+    for name, value in zip(['concurrency', 'device_concurrency'], limits):
+        if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+            logging.warning(f'{name} has to be a whole number of 1 or more, not {value}')
+            return None
+    return limits
 
 
 def get_job_attributes(job):
@@ -152,11 +203,56 @@ def get_job_attributes(job):
     if not job.get('pattern'):
         job['pattern'] = '*'
 
+    # Check archive settings
+    if not job.get('compression'):
+        job['compression'] = 'none'
+    elif job.get('compression') not in COMPRESSIONS:
+        logging.warning(f'Compression {job.get("compression")} not recognized')
+        return None
+    elif job.get('compression') == 'zst' and not _zstandard():
+        logging.warning('zstandard not available. Try "pip install zstandard"')
+        return None
+
+    if not job.get('archive_size'):
+        job['archive_size'] = ARCHIVE_SIZE
+
+    # Check durability settings
+    if not job.get('durability'):
+        job['durability'] = 'none'
+    elif job.get('durability') not in DURABILITIES:
+        logging.warning(f'Durability {job.get("durability")} not recognized')
+        return None
+
+    if not job.get('sync_batch'):
+        job['sync_batch'] = SYNC_BATCH
+
+    # Check stat filters
+    try:
+        for k in ['min_size', 'max_size']:
+            if job.get(k) is not None:
+                job[k] = parse_size(job[k])
+        for k in ['older_than', 'newer_than']:
+            if job.get(k) is not None:
+                job[k] = parse_age(job[k])
+        if job.get('owner') is not None:
+            job['owner'] = parse_owner(job['owner'])
+    except (ValueError, KeyError, ImportError) as e:
+        logging.warning(f'Invalid filter: {e}')
+        return None
+
+    # Check read order
+    if not job.get('read_order'):
+        job['read_order'] = 'none'
+    elif job.get('read_order') not in READ_ORDERS:
+        logging.warning(f'Read order {job.get("read_order")} not recognized')
+        return None
+
     # Print attributes to log
-    prefix = job_prefix(job)
-    logging.debug(f'{prefix} Job attributes')
-    for attr in job.keys():
-        logging.debug(f'{prefix} {attr.title()}: {job[attr]}')
+    if logger.isEnabledFor(logging.DEBUG):
+        prefix = job_prefix(job)
+        logger.debug('%s Job attributes', prefix)
+        for attr in job.keys():
+            logger.debug('%s %s: %s', prefix, attr.title(), job[attr])
 
     return job
 
@@ -174,39 +270,31 @@ def files_paths(paths):
 
 
 def sort_paths(paths):
-    """Returns a list ordered by path length"""
-    output = []
-    longest = 0
-    for path in paths:
-        length = len(str(path.resolve()))
-        if length >= longest:
-            output.insert(0, path)
-            longest = length
-        else:
-            output.insert(len(output), path)
-
-    return output
+    """Returns a list ordered by path length, longest first"""
+    return sorted(paths, key=lambda path: len(str(path.resolve())), reverse=True)
 
 
-def run_job(**job):
+def run_job(rules=None, cache=None, **job):
     # Get attributes and check if the job is valid
-    logging.info(f'Running job: {job.get("name")}')
+    name = job.get('name')
+    logging.info(f'Running job: {name}')
     job = get_job_attributes(job)
 
     if not job:
-        logging.info(f'Job failed: {job.get("name")}')
+        logging.info(f'Job failed: {name}')
         return None
 
+    # Get rules once for the whole job
+    if not rules:
+        rules = get_rules()
+
     # Setup paths
-    job_source = job['source']
-    job_dest = job['destination']
-    paths = get_paths(job['source'], pattern=job['pattern'], subdirs=job['subdirs'])
-    files = files_paths(paths)
-    folders = folders_paths(paths)
+    entries = scan(job['source'], pattern=job['pattern'], subdirs=job['subdirs'], cache=cache,
+                   stat_filter=compile_filter(job))
     if job['target'] == 'files' or job['target'] == 'both':
-        organize_files(job, files)
+        organize_files(job, entries.files(), rules, cache)
     if job['target'] == 'folders' or job['target'] == 'both':
-        organize_folders(job, sort_paths(folders))
+        organize_folders(job, sort_paths(entries.folders()), rules)
 
     # Run sub jobs
     if job.get('jobs'):
@@ -224,7 +312,45 @@ def run_job(**job):
                 # Inherit
                 if not j.get(k):
                     j[k] = job[k]
-            run_job(**j)
+            run_job(rules=rules, cache=cache, **j)
+
+
+def plan_job(rules=None, **job):
+    """Return the planned operations of a job and its sub jobs without changing anything
+
+    Returns:
+        list: list of (operation, source, destination) tuples
+    """
+    job = get_job_attributes(job)
+    if not job:
+        return []
+    if not rules:
+        rules = get_rules()
+
+    plan = []
+    entries = scan(job['source'], pattern=job['pattern'], subdirs=job['subdirs'], stat_filter=compile_filter(job))
+    if job['operation'] == 'archive':
+        # Files go into bundles, folders are left alone
+        if job['target'] == 'files' or job['target'] == 'both':
+            plan.extend((job['operation'], s, d) for s, d in plan_archive(job, entries.files(), rules))
+    else:
+        if job['target'] == 'files' or job['target'] == 'both':
+            plan.extend((job['operation'], s, d) for s, d in plan_files(job, entries.files(), rules))
+        if job['target'] == 'folders' or job['target'] == 'both':
+            plan.extend((job['operation'], s, d)
+                        for s, d in plan_folders(job, sort_paths(entries.folders()), rules))
+
+    for j in job.get('jobs', []):
+        j = dict(j)
+        for k in job.keys():
+            if k == 'name':
+                j[k] = ':'.join([job['name'], j.get('name', '')])
+            elif k == 'jobs':
+                continue
+            if not j.get(k):
+                j[k] = job[k]
+        plan.extend(plan_job(rules=rules, **j))
+    return plan
 
 
 def job_prefix(job):
@@ -232,79 +358,234 @@ def job_prefix(job):
         'copy': 'cp',
         'move': 'mv',
         'delete': 'del',
-        'dryrun': 'dry'
+        'dryrun': 'dry',
+        'archive': 'arc',
+        'extract': 'ext',
+        'link': 'ln',
+        'symlink': 'sym'
     }
     p = prefixes.get(job["operation"], job["operation"][0:1])
     return f'[{job["name"]} @ {p.upper()}]'
 
 
-def organize_files(job, files):
-    for n, f in enumerate(files):
-        prefix = job_prefix(job)
-        logging.info(f'{prefix} Processing {n + 1} of {len(files)} files')
+def plan_files(job, files, rules=None):
+    """Plan the destination of every file
+
+    Args:
+        job: dict with job attributes
+        files: Entries or list of Path objects
+        rules: dict with rules
 
-        # Setup file dicts
-        source_file = {'path': f}
-        destination_file = {'path': job['destination']}
+    Returns:
+        Plan: iterates as (source, destination) tuples
+    """
+    if not rules:
+        rules = get_rules()
+    extensions = get_extensions(rules) if job['group'] else None
+    root = os.fspath(job['destination'])
+
+    # Works on folder and name strings, Path objects are made when the plan is read
+    plan = Plan(OPERATIONS, dirs=getattr(files, 'dirs', None))
+    for folder, name, size, mtime in entry_items(files):
+        destination = root
 
         # Get group
+        group = None
         if job['group']:
-            group = group_from_path(f)
+            group = group_from_name(name, extensions)
             if group:
-                destination_file['path'] = destination_file['path'] / group
+                destination = os.path.join(root, group)
 
         # Clean filename
-        if job['filename']:
-            filename = clean_string(f.name)
-            destination_file['path'] = destination_file['path'] / filename
-        else:
-            destination_file['path'] = destination_file['path'] / source_file['path'].name
+        plan.append(folder, name, destination, clean_string(name, rules) if job['filename'] else name,
+                    size, mtime, job['operation'], group)
+    return plan
 
-        # Perform operation
-        if job['operation'] == 'dryrun':
-            logging.info(f'{prefix} {source_file["path"]} -> {destination_file["path"]}')
-        elif job['operation'] == 'copy':
-            logging.info(f'{prefix} {source_file["path"]} -> {destination_file["path"]}')
-            copy(source_file['path'], destination_file['path'], job['verify'])
-        elif job['operation'] == 'move':
-            logging.info(f'{prefix} {source_file["path"]} -> {destination_file["path"]}')
-            move(source_file['path'], destination_file['path'], job['verify'])
-        elif job['operation'] == 'delete':
-            logging.info(f'{prefix} {source_file["path"]} -> 🗑')
 
+@timed('organize_files', items=paths_count)
+def organize_files(job, files, rules=None, cache=None):
+    # Bundle operations work on the whole list of files at once
+    if job['operation'] == 'archive':
+        archive_files(job, files, rules)
+        return
+    elif job['operation'] == 'extract':
+        extract_files(job, files)
+        return
 
-def organize_folders(job, folders):
-    for n, f in enumerate(folders):
-        prefix = job_prefix(job)
-        logging.info(f'{prefix} Processing {n + 1} of {len(folders)} folders')
+    prefix = job_prefix(job)
+    debug = logger.isEnabledFor(logging.DEBUG)
+    plan = plan_files(job, files, rules)
+    dirs = None
+    if job['operation'] in ('copy', 'move', 'link', 'symlink'):
+        # A handful of group folders instead of a mkdir per file
+        dirs = make_dirs(plan.destination_dirs(), job['destination'])
+
+    # Read in disk order instead of scan order when asked to
+    order = range(len(plan))
+    if job['read_order'] != 'none' and job['operation'] in ('copy', 'move'):
+        from ocd.order import read_order
+        order = read_order(plan.sources(), job['read_order'])
+
+    # Copies are synced and moved sources deleted a batch at a time
+    batch = None
+    if job['durability'] == 'batch' and job['operation'] in ('copy', 'move'):
+        batch = SyncBatch(job['sync_batch'])
+
+    progress = Progress(prefix, len(files))
+    try:
+        for i in order:
+            source, destination = plan[i]
+            # Perform operation, the per file lines are only formatted when debugging
+            result = None
+            exists = None
+            if cache is not None and job['operation'] not in ('dryrun', 'delete'):
+                # Taken destination names are known without a stat per file
+                exists = cache.exists(destination)
+            if exists:
+                if debug:
+                    logger.debug('%s %s exists, skipping', prefix, destination)
+            elif job['operation'] == 'dryrun':
+                logger.info('%s %s -> %s', prefix, source, destination)
+            elif job['operation'] == 'delete':
+                if debug:
+                    logger.debug('%s %s -> 🗑', prefix, source)
+            else:
+                if debug:
+                    logger.debug('%s %s -> %s', prefix, source, destination)
+                if job['operation'] == 'copy':
+                    result = copy(source, destination, job['verify'], dirs, job['durability'], batch, exists)
+                elif job['operation'] == 'move':
+                    result = move(source, destination, job['verify'], dirs, job['durability'], batch, exists)
+                elif job['operation'] == 'link':
+                    result = link(source, destination, dirs, exists)
+                elif job['operation'] == 'symlink':
+                    result = symlink(source, destination, dirs, exists)
+                if result and cache is not None:
+                    cache.add(destination)
+                    if job['operation'] == 'move':
+                        cache.discard(source)
+                elif result is None and cache is not None:
+                    # Taken by someone else since the listing was cached
+                    cache.add(destination)
+
+            audit.record(job['name'], job['operation'], source, destination, result)
+            progress.update()
+    finally:
+        # Copies made before a failure are still synced and the sources of those moves deleted
+        if batch is not None:
+            batch.close()
+    progress.done()
+
+
+def _archive_groups(job, files, rules):
+    """Return (destination, bundle name, files) per group, keeping the scan order within each group"""
+    extensions = get_extensions(rules)
+    groups = {}
+    for f in files:
+        group = group_from_path(f, extensions) if job['group'] else None
+        groups.setdefault(group, []).append(f)
+    return [(job['destination'] / group if group else job['destination'], clean_string(group or job['name'], rules),
+             group_files) for group, group_files in groups.items()]
+
+
+def plan_archive(job, files, rules=None):
+    """Return (source, bundle) tuples for the bundles archive_files would write
+
+    Sources are left in place, they're copied into the bundles.
+    """
+    if not rules:
+        rules = get_rules()
+    plan = []
+    for destination, name, group_files in _archive_groups(job, files, rules):
+        bundles = _bundle_paths(destination, name, job['compression'])
+        bundle = None
+        for path, new in _split_bundles(group_files, job['archive_size']):
+            if new:
+                bundle = next(bundles)
+            plan.append((path, bundle))
+    return plan
+
+
+def archive_files(job, files, rules=None):
+    """Bundle files into size capped tar archives, one series of bundles per group"""
+    prefix = job_prefix(job)
+    if not rules:
+        rules = get_rules()
+    progress = Progress(prefix, len(files))
+
+    def added(source, bundle):
+        audit.record(job['name'], job['operation'], source, bundle, True)
+        progress.update()
+
+    for destination, name, group_files in _archive_groups(job, files, rules):
+        logging.info(f'{prefix} Archiving {len(group_files)} files to {destination}')
+        bundles = archive(group_files, destination, name,
+                          root=job['source'],
+                          compression=job['compression'],
+                          max_size=job['archive_size'],
+                          rename=job['filename'],
+                          rules=rules,
+                          added=added)
+        for bundle in bundles:
+            logging.info(f'{prefix} -> {bundle}')
+    progress.done()
+
+
+def extract_files(job, files):
+    """Extract all archives in a list of files to the job destination"""
+    prefix = job_prefix(job)
+    for n, f in enumerate(files):
+        if not is_archive(f):
+            logger.debug('%s %s is not an archive, skipping', prefix, f)
+            continue
+        logging.info(f'{prefix} {f} -> {job["destination"]}')
+        extract(f, job['destination'])
 
-        # Setup file dicts
-        source_folder = {'path': f}
-        destination_folder = {'path': job['destination']}
 
+def plan_folders(job, folders, rules=None):
+    """Plan the destination of every folder, returns a Plan"""
+    if not rules:
+        rules = get_rules()
+    root = os.fspath(job['destination'])
+
+    plan = Plan(OPERATIONS, dirs=getattr(folders, 'dirs', None))
+    for folder, name, size, mtime in entry_items(folders):
         # Clean foldername
-        if job['filename']:
-            foldername = clean_string(f.name)
-            destination_folder['path'] = destination_folder['path'] / foldername
-        else:
-            destination_folder['path'] = destination_folder['path'] / source_folder['path'].name
+        plan.append(folder, name, root, clean_string(name, rules) if job['filename'] else name,
+                    size, mtime, job['operation'])
+    return plan
+
 
+@timed('organize_folders', items=paths_count)
+def organize_folders(job, folders, rules=None):
+    prefix = job_prefix(job)
+    debug = logger.isEnabledFor(logging.DEBUG)
+    progress = Progress(prefix, len(folders), label='folders')
+    for source, destination in plan_folders(job, folders, rules):
         # Perform operation
         if job['cleanup']:
-            if is_empty_dir(source_folder['path']):
-                logging.info(f'{prefix} {source_folder["path"]} -> 🗑')
+            if is_empty_dir(source) and debug:
+                logger.debug('%s %s -> 🗑', prefix, source)
 
+        result = None
         if job['operation'] == 'delete':
-            logging.info(f'{prefix} {source_folder["path"]} -> 🗑')
-            delete(source_folder['path'])
+            if debug:
+                logger.debug('%s %s -> 🗑', prefix, source)
+            result = delete(source)
         elif job['operation'] == 'copy':
-            logging.info(f'{prefix} {source_folder["path"]} -> {destination_folder["path"]}')
-            copy(source_folder['path'], destination_folder['path'])
+            if debug:
+                logger.debug('%s %s -> %s', prefix, source, destination)
+            result = copy(source, destination)
         elif job['operation'] == 'move':
-            logging.info(f'{prefix} {source_folder["path"]} -> {destination_folder["path"]}')
-            move(source_folder['path'], destination_folder['path'])
+            if debug:
+                logger.debug('%s %s -> %s', prefix, source, destination)
+            result = move(source, destination)
         elif job['operation'] == 'dryrun':
-            logging.info(f'{prefix} {source_folder["path"]} -> 🗑')
+            logger.info('%s %s -> 🗑', prefix, source)
+
+        audit.record(job['name'], job['operation'], source, destination, result)
+        progress.update()
+    progress.done()
 
 
 def is_empty_dir(path: Path):
@@ -313,12 +594,19 @@ def is_empty_dir(path: Path):
     return True
 
 
-def group_from_path(path: Path):
+def group_from_path(path: Path, extensions=None):
     # Returns a file type group from the given path
-    extensions = get_extensions()
-    if path.suffix:
-        return extensions.get(path.suffix.lower().lstrip('.'), 'other')
-    logging.debug(f'{path} suffix is "{path.suffix}"')
+    return group_from_name(path.name, extensions)
+
+
+def group_from_name(name, extensions=None):
+    # Returns a file type group from a file name, same suffix rules as Path.suffix
+    if extensions is None:
+        extensions = get_extensions()
+    i = name.rfind('.')
+    if 0 < i < len(name) - 1:
+        return extensions.get(name[i + 1:].lower(), 'other')
+    logger.debug('%s has no suffix', name)
     return None
 
 
@@ -326,46 +614,189 @@ def group_from_path(path: Path):
 #
 # File operations
 #
-def get_paths(path: Path, pattern='*', subdirs=False):
+def get_paths(path: Path, pattern='*', subdirs=False, cache=None, stat_filter=None):
     """Get all files in a directory and/or its subdirectories,
     based ona given pattern.
 
     Args:
         path: root path to scan
-        pattern: the filename pattern
+        pattern: the filename pattern or a list of patterns
         subdirs: whether to search in subdirectories or not
+        cache: Cache with folder listings kept between runs
+        stat_filter: function of a stat result from compile_filter
 
     Returns:
         list: list of Path objects
     """
-    paths = []
-    if subdirs:
-        pattern = f'**/{pattern}'
-    if isinstance(pattern, list):
-        for p in pattern:
-            paths.extend([x for x in path.glob(p)])
-    else:
-        paths = [x for x in path.glob(pattern)]
-    return paths
+    return list(scan(path, pattern, subdirs, cache, stat_filter))
+
+
+@timed('get_paths', items=result_count)
+def scan(path: Path, pattern='*', subdirs=False, cache=None, stat_filter=None):
+    """Like get_paths but returns compact Entries with the kind of every path
+
+    Without a stat_filter nothing is statted. With one, only entries whose
+    name matches are, and their size and mtime are kept in the Entries.
+    """
+    patterns = pattern if isinstance(pattern, list) else [pattern]
+    match = re.compile('|'.join(fnmatch.translate(p) for p in patterns)).match
+    list_dir = cache.list_dir if cache is not None else _list_dir
+
+    # Walk like Path.glob('**/pattern'), without following symlinked folders
+    entries = Entries()
+    folders = [os.fspath(path)]
+    while folders:
+        folder = folders.pop()
+        try:
+            listing = list_dir(folder)
+        except OSError:
+            continue
+        children = []
+        for name, kind in listing:
+            if match(name):
+                if stat_filter is None:
+                    entries.append(folder, name, kind)
+                else:
+                    try:
+                        st = os.stat(os.path.join(folder, name))
+                    except OSError:
+                        # Gone or a broken symlink
+                        st = None
+                    if st is not None and stat_filter(st):
+                        # The stat follows symlinks, so it tells their kind too
+                        resolved = DIR if stat.S_ISDIR(st.st_mode) else FILE if stat.S_ISREG(st.st_mode) else OTHER
+                        entries.append(folder, name, resolved, st.st_size, st.st_mtime_ns)
+            if subdirs and kind == DIR:
+                children.append(os.path.join(folder, name))
+        folders.extend(reversed(children))
+    return entries
+
+
+def compile_filter(job, now=None):
+    """Compile the size, age and owner filters of a job into a function of a stat result
+
+    Sizes only apply to files, ages are compared with the modification time.
+
+    Returns:
+        function or None when the job has no filters
+    """
+    min_size = job.get('min_size')
+    max_size = job.get('max_size')
+    older_than = job.get('older_than')
+    newer_than = job.get('newer_than')
+    owner = job.get('owner')
+    if min_size is None and max_size is None and older_than is None and newer_than is None and owner is None:
+        return None
+
+    now = time.time() if now is None else now
+    latest = now - older_than if older_than is not None else None
+    earliest = now - newer_than if newer_than is not None else None
+
+    def stat_filter(st):
+        if stat.S_ISREG(st.st_mode):
+            if min_size is not None and st.st_size < min_size:
+                return False
+            if max_size is not None and st.st_size > max_size:
+                return False
+        if latest is not None and st.st_mtime > latest:
+            return False
+        if earliest is not None and st.st_mtime < earliest:
+            return False
+        if owner is not None and st.st_uid != owner:
+            return False
+        return True
+    return stat_filter
+
+
+SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+AGE_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+def _parse_unit(value, units, suffix=''):
+    if isinstance(value, (int, float)):
+        return value
+    letters = ''.join(units)
+    found = re.fullmatch(rf'\s*([0-9.]+)\s*([{letters}]?){suffix}\s*', str(value).lower())
+    if not found:
+        raise ValueError(f'Can\'t parse {value}')
+    return float(found.group(1)) * units[found.group(2)]
+
+
+def parse_size(value):
+    """Return bytes from a number or a string like 100B, 512K, 10MB or 1.5G"""
+    return int(_parse_unit(value, SIZE_UNITS, 'b?'))
+
+
+def parse_age(value):
+    """Return seconds from a number or a string like 30m, 12h, 1d or 2w"""
+    return _parse_unit(value, AGE_UNITS)
+
+
+def parse_owner(value):
+    """Return the user id of a user name or id"""
+    if isinstance(value, int) or str(value).isdigit():
+        return int(value)
+    import pwd
+    return pwd.getpwnam(value).pw_uid
+
+
+def _list_dir(path):
+    with os.scandir(path) as it:
+        return [(e.name, entry_kind(e)) for e in it]
 
 
 def verify_checksums(path_a, path_b):
-    """Compare the checksum of two files"""
+    """Compare the checksum of two files, both hashed the same way"""
     hash_a = get_checksum(path_a)
-    hash_b = get_checksum(path_b)
+    hash_b = get_checksum(path_b, chunk_size=checksum_chunk_size(hash_a))
     if hash_a == hash_b:
         return True
     return False
 
 
-def get_checksum(path: Path):
-    """Return the checksum for a file"""
+def get_checksums(paths, read_order='none'):
+    """Return a dict with the checksum of every file, read in the given order"""
+    from ocd.order import read_order as order_paths
+    paths = list(paths)
+    return {paths[i]: get_checksum(paths[i]) for i in order_paths(paths, read_order)}
+
+
+def checksum_chunk_size(checksum):
+    """Return the chunk size of a tree checksum, 0 for a single pass checksum"""
+    if checksum.startswith('tree-'):
+        return int(checksum.split(':', 1)[0].rsplit('-', 1)[1])
+    return 0
+
+
+def _hash_function():
+    xxhash = _xxhash()
     if xxhash:
-        h = xxhash.xxh3_64()
-    else:
-        logging.info('xxhash not available. Try "pip install xxhash"')
-        h = hashlib.md5()
+        return 'xxh3_64', xxhash.xxh3_64
+    import hashlib
+    logging.info('xxhash not available. Try "pip install xxhash"')
+    return 'md5', hashlib.md5
+
 
+@timed('get_checksum', size=path_size)
+def get_checksum(path: Path, chunk_size=None):
+    """Return the checksum for a file
+
+    Files of HASH_LARGE_FILE bytes or more get a tree checksum: chunks are
+    hashed in parallel and the checksum is the hash of the chunk hashes,
+    formatted as tree-<algorithm>-<chunk size>:<hex>. Smaller files are
+    hashed in a single pass and the checksum is the plain hex digest.
+
+    Args:
+        path: file to hash
+        chunk_size: tree chunk size, 0 for a single pass, None to pick by file size
+    """
+    name, new = _hash_function()
+    if chunk_size is None:
+        chunk_size = HASH_CHUNK_SIZE if path.stat().st_size >= HASH_LARGE_FILE else 0
+    if chunk_size:
+        return f'tree-{name}-{chunk_size}:{_tree_checksum(path, chunk_size, new)}'
+
+    h = new()
     # Load file in chunks
     with path.open("rb") as f:
         for chunk in iter(lambda: f.read(16384), b""):
@@ -374,58 +805,404 @@ def get_checksum(path: Path):
     return h.hexdigest()
 
 
-def copy(source: Path, destination: Path, verify=False):
-    # TODO: Check if destination file exists
-    if destination.exists():
+def _tree_checksum(path: Path, chunk_size, new):
+    """Hash chunks of a memory mapped file in a thread pool, the hashers release the GIL
+
+    Files that can't be mapped are read in the same chunks instead.
+    """
+    import mmap
+    from concurrent.futures import ThreadPoolExecutor
+
+    def digest(chunk):
+        try:
+            return new(chunk).digest()
+        finally:
+            chunk.release()
+
+    with path.open('rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        digests = []
+        m = None
+        if size:
+            try:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError) as e:
+                # Some filesystems and special files can't be mapped
+                logger.debug('%s can\'t be memory mapped, reading it: %s', path, e)
+        if m is not None:
+            with m:
+                if hasattr(m, 'madvise'):
+                    m.madvise(mmap.MADV_SEQUENTIAL)
+                with memoryview(m) as view, \
+                        ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='ocd-hash') as pool:
+                    chunks = [view[i:i + chunk_size] for i in range(0, size, chunk_size)]
+                    digests = list(pool.map(digest, chunks))
+                    del chunks
+        elif size and hasattr(os, 'pread'):
+            # Same chunks read with positional reads, which release the GIL as well
+            with ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='ocd-hash') as pool:
+                digests = list(pool.map(lambda offset: new(os.pread(f.fileno(), chunk_size, offset)).digest(),
+                                        range(0, size, chunk_size)))
+        elif size:
+            digests = [new(chunk).digest() for chunk in iter(functools.partial(f.read, chunk_size), b'')]
+
+    root = new()
+    for d in digests:
+        root.update(d)
+    return root.hexdigest()
+
+
+def make_dir(path: Path, dirs=None):
+    """Create a folder and its parents unless it's in a set of known folders"""
+    if dirs is not None and path in dirs:
+        return
+    path.mkdir(parents=True, exist_ok=True)
+    if dirs is not None:
+        dirs.add(path)
+
+
+def make_dirs(paths, root: Path, workers=MKDIR_WORKERS):
+    """Create destination folders up front
+
+    Folders below root are created one level at a time, parents first, with
+    the folders of a level created in parallel.
+
+    Args:
+        paths: folders to create
+        root: folder all paths are in, created with its parents
+        workers: threads creating folders on the same level
+
+    Returns:
+        set: folders known to exist, for the dirs argument of the file operations
+    """
+    root.mkdir(parents=True, exist_ok=True)
+    dirs = {root}
+
+    levels = {}
+    for path in paths:
+        if path == root:
+            continue
+        if root not in path.parents:
+            make_dir(path, dirs)
+            continue
+        for parent in [path, *path.parents]:
+            if parent == root:
+                break
+            levels.setdefault(len(parent.parts), set()).add(parent)
+
+    executor = None
+    try:
+        for depth in sorted(levels):
+            level = levels[depth]
+            if len(level) > 1 and workers > 1:
+                if executor is None:
+                    from concurrent.futures import ThreadPoolExecutor
+                    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ocd-mkdir')
+                created = executor.map(_mkdir, level)
+            else:
+                created = map(_mkdir, level)
+            dirs.update(path for path, ok in zip(level, created) if ok)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return dirs
+
+
+def _mkdir(path: Path):
+    try:
+        os.mkdir(path)
+    except FileExistsError:
+        if not os.path.isdir(path):
+            logging.warning(f'Could not create folder {path}, a file is in the way')
+            return False
+    except OSError as e:
+        logging.warning(f'Could not create folder {path}: {e}')
         return False
-    shutil.copy2(source, destination)
+    return True
+
+
+def _copy_file(source: Path, destination: Path, fsync=False):
+    """Copy a file with its metadata through a temporary name
+
+    The destination is preallocated to the size of the source and only gets
+    its name once the copy is complete, so it's never seen half written.
+    Returns False without copying anything if the name is taken by then.
+    """
+    import shutil
+    temp = _temp_path(destination)
+    with source.open('rb') as f_in:
+        size = os.fstat(f_in.fileno()).st_size
+        try:
+            with temp.open('xb') as f_out:
+                if size and hasattr(os, 'posix_fallocate'):
+                    try:
+                        os.posix_fallocate(f_out.fileno(), 0, size)
+                    except OSError as e:
+                        # Not supported on every filesystem
+                        if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL, errno.ENOSYS):
+                            raise
+                # Drops the preallocated space past the end if the source shrank
+                f_out.truncate(_copy_data(f_in, f_out, size))
+                if fsync:
+                    f_out.flush()
+                    os.fsync(f_out.fileno())
+            shutil.copystat(source, temp)
+            published = _publish(temp, destination)
+        except BaseException:
+            temp.unlink(missing_ok=True)
+            raise
+    if not published:
+        temp.unlink()
+    return published
+
+
+def _publish(temp: Path, destination: Path):
+    """Give a finished temporary file its name, returns False if the name is taken
+
+    A hard link never replaces an existing file like a rename does.
+    """
+    try:
+        os.link(temp, destination)
+    except FileExistsError:
+        return False
+    except OSError as e:
+        if e.errno not in (errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP, errno.EMLINK, errno.ENOSYS):
+            raise
+        # No hard links on this filesystem, only the race between check and rename is left
+        if os.path.lexists(destination):
+            return False
+        os.replace(temp, destination)
+        return True
+    os.unlink(temp)
+    return True
+
+
+def _temp_path(destination: Path):
+    """Hidden temporary name next to the destination, short enough for the filesystem"""
+    suffix = generate_string(6)
+    temp = destination.with_name(f'.{destination.name}.{suffix}.part')
+    try:
+        name_max = os.pathconf(destination.parent, 'PC_NAME_MAX')
+    except (OSError, ValueError):
+        name_max = 255
+    if len(os.fsencode(temp.name)) > name_max:
+        import hashlib
+        digest = hashlib.sha1(os.fsencode(destination.name)).hexdigest()[:16]
+        temp = destination.with_name(f'.ocd-{digest}.{suffix}.part')
+    return temp
+
+
+def _copy_data(f_in, f_out, size):
+    """Copy file contents in the kernel where possible, returns the number of bytes written"""
+    if hasattr(os, 'sendfile'):
+        offset = 0
+        try:
+            while True:
+                sent = os.sendfile(f_out.fileno(), f_in.fileno(), offset, max(size, 8 * 1024 ** 2))
+                if not sent:
+                    return offset
+                offset += sent
+        except OSError as e:
+            if offset or e.errno not in (errno.EINVAL, errno.ENOSYS, errno.ENOTSUP, errno.ENOTSOCK):
+                raise
+    import shutil
+    shutil.copyfileobj(f_in, f_out, 1024 ** 2)
+    return f_out.tell()
+
+
+def _fsync(path: Path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_dir(path: Path):
+    """Sync a folder so that names added to it survive a power loss"""
+    # Folders can't be opened on Windows
+    if hasattr(os, 'O_DIRECTORY'):
+        _fsync(path)
+
+
+class SyncBatch:
+    """Copies waiting for a batched fsync
+
+    Sources of moved files are only deleted once their copies and the
+    destination folders are synced, so a power loss can't lose both.
+    """
+
+    def __init__(self, size=SYNC_BATCH, workers=SYNC_WORKERS):
+        self.size = size
+        self.workers = workers
+        self._files = []
+        self._sources = []
+        self._executor = None
+
+    def add(self, destination: Path, source: Path = None):
+        """Add a copied file and the source to delete after syncing it"""
+        self._files.append(destination)
+        if source is not None:
+            self._sources.append(source)
+        if len(self._files) >= self.size:
+            self.flush()
+
+    def flush(self):
+        """Sync the batch and delete its sources"""
+        if not self._files:
+            return
+        if self.workers > 1 and len(self._files) > 1:
+            if self._executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ocd-sync')
+            list(self._executor.map(_fsync, self._files))
+        else:
+            for f in self._files:
+                _fsync(f)
+        for folder in {f.parent for f in self._files}:
+            _fsync_dir(folder)
+        for source in self._sources:
+            delete(source)
+        self._files = []
+        self._sources = []
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+@timed('copy', size=path_size, skips=True)
+def copy(source: Path, destination: Path, verify=False, dirs=None, durability='none', batch=None, exists=None):
+    """Copy a file
+
+    Returns True when copied, None when the destination exists and False when the copy failed.
+
+    Args:
+        source: file to copy
+        destination: path of the copy
+        verify: compare checksums after copying
+        dirs: set of folders known to exist
+        durability: none, file to fsync every copy, batch to leave it to a SyncBatch
+        batch: SyncBatch used with the batch durability, syncs per file without one
+        exists: whether the destination exists when the caller already knows, checked when None
+    """
+    # TODO: Check if destination file exists
+    if exists is None:
+        exists = destination.exists()
+    if exists:
+        return None
+    make_dir(destination.parent, dirs)
+    per_file = durability == 'file' or (durability == 'batch' and batch is None)
+    if not _copy_file(source, destination, fsync=per_file):
+        logger.debug('%s -> %s | Skipped, destination exists', source, destination)
+        return None
+    if per_file:
+        _fsync_dir(destination.parent)
     if verify:
         if verify_checksums(source, destination):
-            logging.debug(f'{source} -> {destination} | Successful, verified')
-            return True
+            logger.debug('%s -> %s | Successful, verified', source, destination)
         else:
-            logging.warning(f'{source} -> {destination} | Failed, mismatching checksums')
+            logger.warning('%s -> %s | Failed, mismatching checksums', source, destination)
             return False
 
     # Check if destination exists and return True
     if destination.exists():
-        logging.debug(f'{source} -> {destination} | Successful')
+        if not verify:
+            logger.debug('%s -> %s | Successful', source, destination)
+        if durability == 'batch' and batch is not None:
+            batch.add(destination)
         return True
-    logging.warning(f'{source} -> {destination} | Failed')
+    logger.warning('%s -> %s | Failed', source, destination)
     return False
 
 
-def move(source: Path, destination: Path, verify=False):
+@timed('move', size=path_size, skips=True)
+def move(source: Path, destination: Path, verify=False, dirs=None, durability='none', batch=None, exists=None):
+    """Move a file or folder by copying it and deleting the source
+
+    With the batch durability the source is deleted when the batch is synced.
+    See copy for the arguments and results.
+    """
     # TODO: Check if destination file exists
-    if destination.exists():
-        return False
+    if exists is None:
+        exists = destination.exists()
+    if exists:
+        return None
     # Create destination dir
-    destination.parent.mkdir(parents=True, exist_ok=True)
+    make_dir(destination.parent, dirs)
 
     # Copy file
-    if source.is_file():
-        shutil.copy2(source, destination)
+    per_file = durability == 'file' or (durability == 'batch' and batch is None)
+    is_file = source.is_file()
+    if is_file:
+        if not _copy_file(source, destination, fsync=per_file):
+            logger.debug('%s -> %s | Skipped, destination exists', source, destination)
+            return None
     elif source.is_dir():
         destination.mkdir(parents=True, exist_ok=True)
+    if per_file:
+        _fsync_dir(destination.parent)
 
     if verify:
         if verify_checksums(source, destination):
-            logging.debug(f'{source} -> {destination} | Successful, verified')
-            delete(source)
-            return True
+            logger.debug('%s -> %s | Successful, verified', source, destination)
         else:
-            logging.warning(f'{source} -> {destination} | Failed, mismatching checksums')
+            logger.warning('%s -> %s | Failed, mismatching checksums', source, destination)
             return False
 
     # Check if destination exists and return True
     if destination.exists():
-        logging.debug(f'{source} -> {destination} | Successful')
-        delete(source)
+        if not verify:
+            logger.debug('%s -> %s | Successful', source, destination)
+        if durability == 'batch' and batch is not None and is_file:
+            batch.add(destination, source)
+        else:
+            delete(source)
         return True
-    logging.warning(f'{source} -> {destination} | Failed')
+    logger.warning('%s -> %s | Failed', source, destination)
     return False
 
 
+def link(source: Path, destination: Path, dirs=None, exists=None):
+    """Hardlink a file to the destination, or symlink it when they are on different devices"""
+    if exists is None:
+        exists = destination.exists() or destination.is_symlink()
+    if exists:
+        return None
+    make_dir(destination.parent, dirs)
+
+    if source.stat().st_dev != destination.parent.stat().st_dev:
+        return symlink(source, destination, dirs, False)
+    try:
+        os.link(source, destination)
+    except OSError as e:
+        # Some filesystems don't support hardlinks at all
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+        return symlink(source, destination, dirs, False)
+
+    logger.debug('%s -> %s | Successful, hardlinked', source, destination)
+    return True
+
+
+def symlink(source: Path, destination: Path, dirs=None, exists=None):
+    """Symlink a file to the destination"""
+    if exists is None:
+        exists = destination.exists() or destination.is_symlink()
+    if exists:
+        return None
+    make_dir(destination.parent, dirs)
+
+    destination.symlink_to(source.absolute())
+    logger.debug('%s -> %s | Successful, symlinked', source, destination)
+    return True
+
+
+@timed('delete')
 def delete(path: Path):
     if path.is_file():
         path.unlink()
@@ -433,6 +1210,186 @@ def delete(path: Path):
         path.rmdir()
 
 
+#
+#
+# Archives
+#
+class _Bundle:
+    """A tar archive being streamed to disk together with its index"""
+
+    def __init__(self, path: Path, compression='none'):
+        import tarfile
+        self.path = path
+        self.compression = compression
+        self.size = 0
+        self.members = []
+        self._file = path.open('wb')
+        if compression == 'zst':
+            self._stream = _zstandard().ZstdCompressor().stream_writer(self._file)
+            self._tar = tarfile.open(fileobj=self._stream, mode='w|')
+        elif compression == 'gz':
+            self._stream = None
+            self._tar = tarfile.open(fileobj=self._file, mode='w|gz')
+        else:
+            self._stream = None
+            self._tar = tarfile.open(fileobj=self._file, mode='w|')
+
+    def add(self, source: Path, arcname: str):
+        info = self._tar.gettarinfo(str(source), arcname=arcname)
+        # Offset of the member header in the uncompressed tar stream
+        offset = self._tar.offset
+        with source.open('rb') as f:
+            self._tar.addfile(info, f)
+        self.size += info.size
+        self.members.append({'name': arcname,
+                             'size': info.size,
+                             'mtime': info.mtime,
+                             'offset': offset,
+                             'source': str(source)})
+
+    def close(self):
+        self._tar.close()
+        if self._stream:
+            self._stream.close()
+        self._file.close()
+        _write_index(self.path, {'bundle': self.path.name,
+                                 'compression': self.compression,
+                                 'size': self.size,
+                                 'members': self.members})
+        return self.path
+
+
+def is_archive(path: Path):
+    """Check if a path looks like a bundle created by archive()"""
+    return path.name.endswith(tuple(ARCHIVE_SUFFIXES.values())) or path.suffix == '.tgz'
+
+
+def index_path(bundle: Path):
+    """Return the path of the index file belonging to a bundle"""
+    return bundle.with_name(f'{bundle.name}.index.json')
+
+
+def _write_index(bundle: Path, index):
+    with index_path(bundle).open('w', encoding='utf8') as json_file:
+        # dumps uses the C encoder, dump streams through the Python one
+        json_file.write(json.dumps(index, ensure_ascii=False))
+
+
+def _bundle_paths(destination: Path, name, compression='none'):
+    # Never overwrite an existing bundle, continue the numbering instead
+    n = 1
+    while True:
+        path = destination / f'{name}_{n:04d}{ARCHIVE_SUFFIXES[compression]}'
+        if not path.exists() and not index_path(path).exists():
+            yield path
+        n += 1
+
+
+def _split_bundles(paths, max_size):
+    """Yield every path and whether it starts a new bundle, a bundle holds files up to max_size bytes"""
+    size = None
+    for path in paths:
+        file_size = path.stat().st_size
+        new = size is None or (size and size + file_size > max_size)
+        size = file_size if new else size + file_size
+        yield path, new
+
+
+def _arcname(path: Path, root=None, rename=True, rules=None, cleaned=None):
+    # Keep the structure relative to the job source so names stay unique
+    try:
+        parts = path.relative_to(root).parts if root else (path.name,)
+    except ValueError:
+        parts = (path.name,)
+    if rename:
+        # Folder names repeat for every file in them, clean them once
+        folders = []
+        for p in parts[:-1]:
+            name = cleaned.get(p) if cleaned is not None else None
+            if name is None:
+                name = clean_string(p, rules)
+                if cleaned is not None:
+                    cleaned[p] = name
+            folders.append(name)
+        parts = folders + [clean_string(parts[-1], rules)]
+    return '/'.join(parts)
+
+
+def archive(paths, destination: Path, name, root=None, compression='none', max_size=ARCHIVE_SIZE, rename=True,
+            rules=None, added=None):
+    """Stream files into size capped tar bundles with an index file per bundle
+
+    Args:
+        paths: list of file paths to archive
+        destination: folder to write the bundles to
+        name: base name of the bundles, a running number and suffix is appended
+        root: paths are stored relative to this folder
+        compression: none, gz or zst
+        max_size: start a new bundle when the content would exceed this many bytes
+        rename: clean the member names
+        rules: dict with rules used to clean the member names
+        added: function called with every path and the bundle it was added to
+
+    Returns:
+        list: list of bundle paths
+    """
+    destination.mkdir(parents=True, exist_ok=True)
+    if rename and not rules:
+        rules = get_rules()
+    bundles = []
+    bundle = None
+    cleaned = {}
+    names = _bundle_paths(destination, name, compression)
+    for path, new in _split_bundles(paths, max_size):
+        if new:
+            if bundle:
+                bundles.append(bundle.close())
+            bundle = _Bundle(next(names), compression)
+        bundle.add(path, _arcname(path, root, rename, rules, cleaned))
+        if added:
+            added(path, bundle.path)
+    if bundle:
+        bundles.append(bundle.close())
+    return bundles
+
+
+def extract(bundle: Path, destination: Path):
+    """Extract a bundle to a folder"""
+    import tarfile
+    destination.mkdir(parents=True, exist_ok=True)
+    # Refuse absolute paths, links outside the destination etc. where supported
+    kwargs = {'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}
+    with bundle.open('rb') as f:
+        if bundle.suffix == '.zst':
+            zstandard = _zstandard()
+            if not zstandard:
+                logging.warning('zstandard not available. Try "pip install zstandard"')
+                return False
+            with zstandard.ZstdDecompressor().stream_reader(f) as stream:
+                with tarfile.open(fileobj=stream, mode='r|') as tar:
+                    tar.extractall(destination, **kwargs)
+        else:
+            with tarfile.open(fileobj=f, mode='r|*') as tar:
+                tar.extractall(destination, **kwargs)
+    return True
+
+
+def find_in_archives(path: Path, name):
+    """Look up a file in the bundle indexes below a folder without opening any bundle
+
+    Returns:
+        list: list of (bundle path, member dict) tuples
+    """
+    found = []
+    for index_file in path.rglob('*.index.json'):
+        with index_file.open('r') as json_file:
+            index = json.load(json_file)
+        for member in index.get('members', []):
+            if member['name'] == name or member['name'].rsplit('/', 1)[-1] == name:
+                found.append((index_file.with_name(index['bundle']), member))
+    return found
+
+
 # def delete_empty_folders(path):
 #     path = Path(path)
 #     folders = [x for x in path.rglob('*') if x.is_dir()]
@@ -630,6 +1587,8 @@ def get_extensions(rules=None):
 
 
 def generate_string(length=5):
+    import random
+    import string
     letters = []
     for i in range(length):
         l = string.ascii_letters[random.randint(0, len(string.ascii_letters) - 1)]
@@ -637,46 +1596,6 @@ def generate_string(length=5):
     return ''.join(letters)
 
 
-def cli():
-    """Command line interface"""
-    # Create the parser
-    parser = argparse.ArgumentParser(description="Organize files")
-
-    # Add the arguments
-    parser.add_argument("source",
-                        type=str,
-                        help="The source folder")
-
-    parser.add_argument("-d", "--destination",
-                        type=str,
-                        help="The destination folder",
-                        action="store")
-
-    parser.add_argument("-g", "--group",
-                        help="Group files by type",
-                        action="store_true")
-
-    parser.add_argument("--group-prefix",
-                        dest='gprefix',
-                        help="Add prefix to group folder",
-                        action="store")
-
-    parser.add_argument("--dryrun",
-                        help="Run the script without actually changing any files",
-                        action="store_true")
-
-    # Execute the parse_args() method
-    args = parser.parse_args()
-
-    # Run offloader
-    # organizer = Organizer(source=args.source,
-    #                       destination=args.destination,
-    #                       group=args.group,
-    #                       group_prefix=args.gprefix)
-    #
-    # organizer.organize(mode="move")
-
-
 if __name__ == '__main__':
-    # cli()
-    run_jobs()
+    from ocd.cli import main
+    main()
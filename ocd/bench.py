@@ -0,0 +1,498 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+bench.py
+Benchmarks for the scan/organize/verify pipeline on synthetic trees.
+
+    python -m ocd.bench --files 10000 --output results.json
+    python -m ocd.bench --files 10000 --compare results.json
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from ocd import app, LOGGING_CONFIG
+from ocd.store import Entries
+
+EXAMPLE_RULES = Path(__file__).parent / 'rules_example.json'
+DEFAULT_GROUPS = ['configuration', 'web', 'developer', 'document', 'picture', 'video', 'audio']
+
+# Wall time allowed for a cold start of the command line interface
+STARTUP_BUDGET = 0.15
+
+# organize_files modes the benchmark can run
+BENCH_OPERATIONS = ['dryrun', 'copy', 'verify', 'move', 'archive'] + [f'{op}:{durability}'
+                                                                      for op in ['copy', 'move']
+                                                                      for durability in ['file', 'batch']]
+
+# Plan size the memory benchmark extrapolates to
+MEMORY_TARGET_ENTRIES = 10_000_000
+
+# Characters clean_string has to deal with
+NAME_CHARACTERS = 'abcdefghijklmnopqrstuvwxyz0123456789 _-åäöé'
+
+
+def random_bytes(rng, n):
+    """n random bytes from a seeded Random, Random.randbytes needs Python 3.9"""
+    return rng.getrandbits(n * 8).to_bytes(n, 'little') if n else b''
+
+
+def generate_tree(root: Path, files=1000, depth=3, width=4, median_size=4096, sigma=1.5,
+                  groups=None, seed=0, rules=None):
+    """Create a reproducible tree of files
+
+    Args:
+        root: folder to create the tree in
+        files: number of files
+        depth: number of folder levels below root
+        width: number of subfolders per folder
+        median_size: median file size in bytes, sizes are log-normally distributed
+        sigma: spread of the size distribution
+        groups: groups from rules to draw extensions from
+        seed: random seed
+        rules: rules with groups, defaults to rules_example.json
+
+    Returns:
+        tuple: list of file paths, total size in bytes
+    """
+    rng = random.Random(seed)
+    if rules is None:
+        rules = app._load_rules(EXAMPLE_RULES)
+    groups = groups or DEFAULT_GROUPS
+    extensions = [rules['groups'][g] for g in groups if g in rules.get('groups', {})]
+
+    # Folders at every level, files are spread over all of them
+    folders = [root]
+    level = [root]
+    for d in range(depth):
+        level = [p / f'dir {d}{n}' for p in level for n in range(width)]
+        folders.extend(level)
+    for folder in folders:
+        folder.mkdir(parents=True, exist_ok=True)
+
+    paths = []
+    total = 0
+    chunk = random_bytes(rng, 1024 * 1024)
+    for n in range(files):
+        name = ''.join(rng.choice(NAME_CHARACTERS) for _ in range(rng.randint(4, 16)))
+        ext = rng.choice(rng.choice(extensions))
+        path = rng.choice(folders) / f'{name}_{n}.{ext}'
+        size = min(int(rng.lognormvariate(math.log(median_size), sigma)), len(chunk) * 64)
+        with path.open('wb') as f:
+            remaining = size
+            while remaining > 0:
+                f.write(chunk[:remaining])
+                remaining -= len(chunk)
+        paths.append(path)
+        total += size
+    return paths, total
+
+
+def generate_folders(root: Path, depth=3, width=4):
+    """Create a tree of empty folders, returns the number of folders"""
+    level = [root]
+    count = 0
+    for d in range(depth):
+        level = [p / f'dir {d}{n}' for p in level for n in range(width)]
+        for p in level:
+            p.mkdir(parents=True, exist_ok=True)
+        count += len(level)
+    return count
+
+
+def result(name, seconds, files=0, nbytes=0, error=None):
+    """Format a single benchmark result"""
+    output = {'name': name,
+              'seconds': round(seconds, 6),
+              'files': files,
+              'bytes': nbytes,
+              'files_per_sec': round(files / seconds, 1) if seconds else 0.0,
+              'mb_per_sec': round(nbytes / seconds / 1024 ** 2, 2) if seconds else 0.0}
+    if error:
+        output['error'] = error
+    return output
+
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def bench_scan(root: Path, repeat=3, rules=None):
+    """Time get_paths, clean_string and group_from_path on an existing tree"""
+    if rules is None:
+        rules = app._load_rules(EXAMPLE_RULES)
+    extensions = app.get_extensions(rules)
+    paths = app.files_paths(app.get_paths(root, subdirs=True))
+    names = [p.name for p in paths]
+    results = [
+        result('get_paths', min(_timed(app.get_paths, root, subdirs=True) for _ in range(repeat)), len(paths)),
+        result('clean_string', min(_timed(lambda: [app.clean_string(n, rules) for n in names])
+                                   for _ in range(repeat)), len(names)),
+        result('group_from_path', min(_timed(lambda: [app.group_from_path(p, extensions) for p in paths])
+                                      for _ in range(repeat)), len(paths)),
+    ]
+    return results
+
+
+def bench_startup(work: Path, repeat=5, budget=STARTUP_BUDGET):
+    """Time a cold start of python -m ocd plan with a rules file without jobs
+
+    Bytecode caching is forced on so the numbers match an installed package.
+    Reports the best wall time and the slowest imports from python -X importtime.
+    """
+    rules_path = work / 'startup_rules.json'
+    app._write_rules(rules_path, {'logging': LOGGING_CONFIG, 'jobs': []})
+    command = [sys.executable, '-X', 'importtime', '-m', 'ocd', 'plan', '--rules', str(rules_path)]
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    env['PYTHONPATH'] = os.pathsep.join([str(Path(__file__).parent.parent)] +
+                                        [x for x in [env.get('PYTHONPATH')] if x])
+
+    seconds = []
+    imports = {}
+    # The first run only warms the bytecode cache
+    for i in range(repeat + 1):
+        start = time.perf_counter()
+        output = subprocess.run(command, env=env, capture_output=True, text=True)
+        elapsed = time.perf_counter() - start
+        if i == 0:
+            continue
+        seconds.append(elapsed)
+        imports = parse_importtime(output.stderr)
+
+    output = result('startup', min(seconds))
+    output['budget'] = budget
+    output['within_budget'] = min(seconds) <= budget
+    output['import_seconds'] = round(sum(imports.values()), 6)
+    output['slowest_imports'] = dict(sorted(imports.items(), key=lambda x: x[1], reverse=True)[:5])
+    return output
+
+
+def parse_importtime(text):
+    """Return the cumulative seconds of every top level import in python -X importtime output"""
+    imports = {}
+    for line in text.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        # Nested imports are indented
+        if name.startswith('  '):
+            continue
+        imports[name.strip()] = int(cumulative) / 1e6
+    return imports
+
+
+def _traced(func):
+    """Return the result of a function and the bytes it left allocated"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        output = func()
+        return output, tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+
+def bench_memory(entries=20000, depth=3, width=4, groups=None, seed=0, rules=None):
+    """Measure the memory of a scanned and planned tree with tracemalloc
+
+    Compares lists of Path objects with one {'path': ...} dict pair per file,
+    as organize_files used to build, with Entries and a Plan. Names are made
+    up in memory, no files are created.
+    """
+    rng = random.Random(seed)
+    if rules is None:
+        rules = app._load_rules(EXAMPLE_RULES)
+    groups = groups or DEFAULT_GROUPS
+    extensions = [e for g in groups for e in rules.get('groups', {}).get(g, [])]
+    folders = ['/bench']
+    level = folders
+    for d in range(depth):
+        level = [f'{f}/folder_{i:02d}' for f in level for i in range(width)]
+        folders.extend(level)
+    items = [(rng.choice(folders),
+              ''.join(rng.choice(NAME_CHARACTERS) for _ in range(rng.randint(6, 24)))
+              + '.' + rng.choice(extensions))
+             for _ in range(entries)]
+    job = app.get_job_attributes({'name': 'bench', 'source': '/', 'destination': '/organized'})
+    job_extensions = app.get_extensions(rules)
+
+    def paths():
+        folder_paths = {f: Path(f) for f in folders}
+        files = [folder_paths[folder] / name for folder, name in items]
+        plan = []
+        for f in files:
+            destination = job['destination']
+            group = app.group_from_path(f, job_extensions)
+            if group:
+                destination = destination / group
+            plan.append(({'path': f}, {'path': destination / app.clean_string(f.name, rules)}))
+        return files, plan
+
+    def store():
+        files = Entries()
+        for folder, name in items:
+            files.append(folder, name)
+        return files, app.plan_files(job, files, rules)
+
+    results = []
+    for name, func in [('memory[paths]', paths), ('memory[store]', store)]:
+        start = time.perf_counter()
+        output, nbytes = _traced(func)
+        r = result(name, time.perf_counter() - start, entries)
+        r['memory'] = nbytes
+        r['bytes_per_entry'] = round(nbytes / entries, 1)
+        r['target_mb'] = round(nbytes / entries * MEMORY_TARGET_ENTRIES / 1024 ** 2, 1)
+        results.append(r)
+        del output
+    results[1]['reduction'] = round(results[0]['memory'] / results[1]['memory'], 2)
+    return results
+
+
+def drop_cache(paths):
+    """Ask the kernel to drop cached pages of files, returns False where that isn't supported"""
+    if not hasattr(os, 'posix_fadvise'):
+        return False
+    os.sync()
+    for path in paths:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+    return True
+
+
+def bench_read_order(root: Path, files=1000, median_size=4096, sigma=1.5, seed=0, orders=None):
+    """Time hashing a tree in scan, inode and physical order with a cold page cache
+
+    Meant for a folder on a loop mounted image or a spinning disk, where the
+    order files are read in decides how much the disk seeks. Files are written
+    in shuffled order so that scan order and disk order differ.
+    """
+    from ocd import READ_ORDERS
+    rng = random.Random(seed)
+    orders = orders or READ_ORDERS
+    work = Path(tempfile.mkdtemp(prefix='ocd_read_order_', dir=root))
+    try:
+        sizes = [max(1, int(rng.lognormvariate(math.log(median_size), sigma))) for _ in range(files)]
+        names = [f'file_{i:07d}.bin' for i in range(files)]
+        written = list(range(files))
+        rng.shuffle(written)
+        for i in written:
+            folder = work / f'folder_{i % 16:02d}'
+            folder.mkdir(exist_ok=True)
+            (folder / names[i]).write_bytes(random_bytes(rng, sizes[i]))
+        paths = list(app.scan(work, subdirs=True).files())
+        nbytes = sum(sizes)
+
+        results = []
+        for order in orders:
+            cold = drop_cache(paths)
+            name = f'read_order[{order}]'
+            try:
+                seconds = _timed(app.get_checksums, paths, order)
+            except OSError as e:
+                logging.warning(f'{name} failed: {e}')
+                results.append(result(name, 0.0, files, error=str(e)))
+                continue
+            r = result(name, seconds, files, nbytes)
+            r['cold'] = cold
+            results.append(r)
+        return results
+    finally:
+        shutil.rmtree(work)
+
+
+def bench_organize(work: Path, operation, verify=False, durability='none', **tree):
+    """Time organize_files on a fresh tree, since copy and move change the destination"""
+    source = work / 'source'
+    destination = work / 'destination'
+    paths, nbytes = generate_tree(source, **tree)
+    job = app.get_job_attributes({'name': 'bench',
+                                  'source': source,
+                                  'destination': destination,
+                                  'operation': operation,
+                                  'subdirs': True,
+                                  'verify': verify,
+                                  'durability': durability})
+    files = app.scan(source, subdirs=True).files()
+    rules = app._load_rules(EXAMPLE_RULES)
+    name = f'organize_files[{operation}{"+verify" if verify else ""}{"" if durability == "none" else ":" + durability}]'
+    try:
+        seconds = _timed(app.organize_files, job, files, rules)
+    except OSError as e:
+        logging.warning(f'{name} failed: {e}')
+        return result(name, 0.0, len(files), error=str(e))
+    finally:
+        shutil.rmtree(source)
+        if destination.exists():
+            shutil.rmtree(destination)
+    return result(name, seconds, len(files), nbytes if operation != 'dryrun' else 0)
+
+
+def bench_delete_folders(work: Path, depth=3, width=4):
+    """Time deleting a tree of empty folders through organize_folders"""
+    source = work / 'folders'
+    count = generate_folders(source, depth=depth, width=width)
+    job = app.get_job_attributes({'name': 'bench',
+                                  'source': source,
+                                  'operation': 'delete',
+                                  'subdirs': True})
+    folders = app.sort_paths(app.scan(source, subdirs=True).folders())
+    try:
+        seconds = _timed(app.organize_folders, job, folders, app._load_rules(EXAMPLE_RULES))
+    except OSError as e:
+        logging.warning(f'organize_folders[delete] failed: {e}')
+        return result('organize_folders[delete]', 0.0, count, error=str(e))
+    finally:
+        shutil.rmtree(source, ignore_errors=True)
+    return result('organize_folders[delete]', seconds, count)
+
+
+def git_commit():
+    """Return the current commit of the source tree, if any"""
+    try:
+        output = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=Path(__file__).parent,
+                                capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.stdout.strip()
+
+
+def run(root=None, files=1000, depth=3, width=4, median_size=4096, sigma=1.5, groups=None, seed=0,
+        repeat=3, operations=None, startup=True, memory_entries=20000, read_order_root=None):
+    """Run all benchmarks in a temporary folder
+
+    Returns:
+        dict: parameters, environment and a list of results
+    """
+    operations = operations or ['dryrun', 'copy', 'verify', 'move']
+    tree = {'files': files, 'depth': depth, 'width': width, 'median_size': median_size,
+            'sigma': sigma, 'groups': groups, 'seed': seed}
+    results = []
+    with tempfile.TemporaryDirectory(prefix='ocd_bench_', dir=root) as tmp:
+        work = Path(tmp)
+
+        scan_root = work / 'scan'
+        generate_tree(scan_root, **tree)
+        results.extend(bench_scan(scan_root, repeat=repeat))
+        shutil.rmtree(scan_root)
+
+        for operation in operations:
+            # Durability levels are given as move:batch
+            operation, _, durability = operation.partition(':')
+            if operation == 'verify':
+                results.append(bench_organize(work, 'copy', verify=True, durability=durability or 'none', **tree))
+            else:
+                results.append(bench_organize(work, operation, durability=durability or 'none', **tree))
+
+        results.append(bench_delete_folders(work, depth=depth + 1, width=width))
+
+        if startup:
+            results.append(bench_startup(work, repeat=repeat))
+
+    if memory_entries:
+        results.extend(bench_memory(memory_entries, depth=depth, width=width, groups=groups, seed=seed))
+
+    if read_order_root:
+        results.extend(bench_read_order(Path(read_order_root), files=files, median_size=median_size,
+                                        sigma=sigma, seed=seed))
+
+    return {'commit': git_commit(),
+            'time': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'params': dict(tree, repeat=repeat),
+            'results': results}
+
+
+def compare(report, baseline):
+    """Return the speedup of every result compared to a baseline report"""
+    old = {r['name']: r for r in baseline.get('results', [])}
+    output = {}
+    for r in report['results']:
+        if r['name'] in old and r['seconds'] and old[r['name']]['seconds']:
+            output[r['name']] = round(old[r['name']]['seconds'] / r['seconds'], 3)
+    return output
+
+
+def print_report(report, speedups=None):
+    speedups = speedups or {}
+    print(f'commit {report["commit"]}  python {report["python"]}  {report["params"]}')
+    print(f'{"benchmark":32} {"seconds":>10} {"files/s":>12} {"MB/s":>10} {"speedup":>8}')
+    for r in report['results']:
+        if r.get('error'):
+            print(f'{r["name"]:32} failed: {r["error"]}')
+            continue
+        speedup = f'{speedups[r["name"]]:.2f}x' if r['name'] in speedups else ''
+        print(f'{r["name"]:32} {r["seconds"]:>10.4f} {r["files_per_sec"]:>12.1f} '
+              f'{r["mb_per_sec"]:>10.2f} {speedup:>8}')
+        if 'budget' in r:
+            status = 'within' if r['within_budget'] else 'OVER'
+            print(f'  {status} budget of {r["budget"]}s, slowest imports: '
+                  + ', '.join(f'{k} {v * 1000:.1f}ms' for k, v in r['slowest_imports'].items()))
+        if 'memory' in r:
+            reduction = f', {r["reduction"]}x less' if 'reduction' in r else ''
+            print(f'  {r["bytes_per_entry"]} bytes per entry, {r["target_mb"]} MB for '
+                  f'{MEMORY_TARGET_ENTRIES:,} entries{reduction}')
+
+
+def cli(argv=None):
+    """Command line interface"""
+    parser = argparse.ArgumentParser(description="Benchmark ocd on synthetic trees")
+    parser.add_argument("--root", help="Folder to create temporary trees in, e.g. /dev/shm")
+    parser.add_argument("--files", type=int, default=1000, help="Number of files")
+    parser.add_argument("--depth", type=int, default=3, help="Folder levels")
+    parser.add_argument("--width", type=int, default=4, help="Subfolders per folder")
+    parser.add_argument("--median-size", type=int, default=4096, help="Median file size in bytes")
+    parser.add_argument("--sigma", type=float, default=1.5, help="Spread of file sizes")
+    parser.add_argument("--groups", nargs='+', help="Groups in rules_example.json to draw extensions from")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--repeat", type=int, default=3, help="Repeats of non destructive benchmarks")
+    parser.add_argument("--operations", nargs='+', choices=BENCH_OPERATIONS,
+                        help="organize_files modes to run, :file and :batch set the durability")
+    parser.add_argument("--no-startup", dest='startup', action="store_false",
+                        help="Skip the cold start benchmark")
+    parser.add_argument("--memory-entries", type=int, default=20000,
+                        help="Entries in the memory benchmark, 0 to skip it")
+    parser.add_argument("--read-order-root",
+                        help="Folder on a loop mounted image or spinning disk to time read orders in")
+    parser.add_argument("--output", help="Store results as JSON")
+    parser.add_argument("--compare", help="JSON results to compare with")
+    args = parser.parse_args(argv)
+
+    # Keep log output from dominating the measurements
+    logging.getLogger().setLevel(logging.WARNING)
+
+    report = run(root=args.root, files=args.files, depth=args.depth, width=args.width,
+                 median_size=args.median_size, sigma=args.sigma, groups=args.groups, seed=args.seed,
+                 repeat=args.repeat, operations=args.operations, startup=args.startup,
+                 memory_entries=args.memory_entries, read_order_root=args.read_order_root)
+
+    speedups = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            speedups = compare(report, json.load(f))
+    print_report(report, speedups)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(cli())
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+cache.py
+Folder listings and destination names kept warm between runs.
+"""
+import os
+import time
+
+from ocd.store import FILE, entry_kind
+
+# Folders modified this recently are not cached, a change within the same
+# mtime tick would otherwise go unnoticed
+RACY_SECONDS = 2.0
+
+
+class Cache:
+    """Folder listings validated by folder mtime
+
+    Listings are used for scanning sources and for checking if a destination
+    name is taken. A folder's mtime changes whenever an entry is added, removed
+    or renamed, so one stat per folder replaces listing it again.
+    """
+
+    def __init__(self):
+        self._dirs = {}
+        self._checked = set()
+
+    def begin_run(self):
+        """Revalidate every folder on first use in the next run"""
+        self._checked = set()
+
+    def _listing(self, path):
+        path = os.fspath(path)
+        st = os.stat(path)
+        cached = self._dirs.get(path)
+        if cached and cached[0] == st.st_mtime_ns:
+            return cached[1]
+
+        with os.scandir(path) as it:
+            entries = {e.name: entry_kind(e) for e in it}
+        if time.time() - st.st_mtime > RACY_SECONDS:
+            self._dirs[path] = (st.st_mtime_ns, entries)
+        else:
+            self._dirs.pop(path, None)
+        return entries
+
+    def list_dir(self, path):
+        """Return (name, kind) tuples for the entries of a folder, kinds are the ones in ocd.store"""
+        return list(self._listing(path).items())
+
+    def exists(self, path):
+        """Check if a path exists using the listing of its parent
+
+        Each parent is statted once per run, names added by this process
+        during the run are tracked with add().
+        """
+        parent = os.fspath(path.parent)
+        if parent in self._checked:
+            cached = self._dirs.get(parent)
+            if cached:
+                return path.name in cached[1]
+        try:
+            entries = self._listing(parent)
+        except FileNotFoundError:
+            return False
+        self._checked.add(parent)
+        if parent not in self._dirs:
+            # Too recent to cache, keep it for this run only
+            self._dirs[parent] = (None, entries)
+        return path.name in entries
+
+    def add(self, path, kind=FILE):
+        """Record a path created by this process"""
+        cached = self._dirs.get(os.fspath(path.parent))
+        if cached:
+            cached[1][path.name] = kind
+
+    def discard(self, path):
+        """Record a path removed by this process"""
+        cached = self._dirs.get(os.fspath(path.parent))
+        if cached:
+            cached[1].pop(path.name, None)
+
+    def __len__(self):
+        return len(self._dirs)
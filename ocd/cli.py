@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+cli.py
+Command line interface.
+
+Arguments are parsed before anything else is imported so that calls that
+only print help or fail on bad arguments stay cheap.
+"""
+import argparse
+import sys
+from ocd import OPERATIONS, TARGETS
+
+COMMANDS = {'run': 'Run the jobs in rules.json',
+            'dryrun': 'Log what the jobs would do without changing any files',
+            'plan': 'Print the planned operations as tab separated lines'}
+
+
+def build_parser():
+    """Create the argument parser"""
+    parser = argparse.ArgumentParser(prog='ocd', description="Organize files")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    for command, help_text in COMMANDS.items():
+        sub = subparsers.add_parser(command, help=help_text, description=help_text)
+        sub.add_argument("--rules",
+                         help="Path to rules.json",
+                         action="store")
+        sub.add_argument("-v", "--verbose",
+                         help="Log debug messages",
+                         action="store_true")
+        sub.add_argument("source",
+                         nargs='?',
+                         help="Run a single job on this folder instead of the jobs in rules.json")
+        sub.add_argument("-j", "--job",
+                         dest='jobs',
+                         help="Only run the job with this name, can be repeated",
+                         action="append")
+        sub.add_argument("-d", "--destination",
+                         help="The destination folder",
+                         action="store")
+        sub.add_argument("-o", "--operation",
+                         choices=OPERATIONS,
+                         help="The operation to perform",
+                         action="store")
+        sub.add_argument("-p", "--pattern",
+                         help="Search pattern",
+                         action="store")
+        sub.add_argument("-t", "--target",
+                         choices=TARGETS,
+                         help="Organize files, folders or both",
+                         action="store")
+        sub.add_argument("-s", "--subdirs",
+                         help="Search through subfolders",
+                         action="store_true")
+
+    # Daemon
+    serve = subparsers.add_parser('serve', help='Run jobs on their schedules in the foreground')
+    trigger = subparsers.add_parser('trigger', help='Make a running daemon run a job now')
+    trigger.add_argument("job", help="Name of the job")
+    status = subparsers.add_parser('status', help='Print the last run stats from a running daemon')
+    status.add_argument("job", nargs='?', help="Name of the job")
+    for sub in [serve, trigger, status]:
+        sub.add_argument("--rules",
+                         help="Path to rules.json",
+                         action="store")
+        sub.add_argument("--socket",
+                         help="Control socket, defaults to ocd.sock next to rules.json",
+                         action="store")
+    return parser
+
+
+def select_jobs(rules, args):
+    """Return the jobs to run from rules and command line arguments"""
+    if args.source:
+        job = {'name': 'cli', 'source': args.source}
+        for k in ['destination', 'operation', 'pattern', 'target', 'subdirs']:
+            if getattr(args, k):
+                job[k] = getattr(args, k)
+        return [job]
+
+    jobs = rules.get('jobs', [])
+    if args.jobs:
+        jobs = [j for j in jobs if j.get('name') in args.jobs]
+    return jobs
+
+
+def force_operation(job, operation):
+    """Return a copy of a job and its sub jobs with the operation replaced"""
+    job = dict(job, operation=operation)
+    if job.get('jobs'):
+        job['jobs'] = [force_operation(j, operation) for j in job['jobs']]
+    return job
+
+
+def main(argv=None):
+    """Command line interface"""
+    args = build_parser().parse_args(argv)
+
+    if args.command in ('serve', 'trigger', 'status'):
+        return daemon_command(args)
+
+    # Only import the rest of ocd once the arguments are known to be valid
+    import copy
+    from ocd import app, LOGGING_CONFIG
+    from ocd.log import setup_logging
+
+    rules = app.get_rules(args.rules)
+    jobs = select_jobs(rules, args)
+    if args.command == 'dryrun':
+        jobs = [force_operation(j, 'dryrun') for j in jobs]
+    rules = dict(rules, jobs=jobs)
+
+    if args.verbose:
+        rules['logging'] = copy.deepcopy(rules.get('logging') or LOGGING_CONFIG)
+        rules['logging'].setdefault('root', {})['level'] = 'DEBUG'
+
+    if args.command == 'plan':
+        setup_logging(rules)
+        for job in jobs:
+            for operation, source, destination in app.plan_job(rules=rules, **job):
+                print(f'{operation}\t{source}\t{destination}')
+        return 0
+
+    app.run_jobs(rules)
+    return 0
+
+
+def daemon_command(args):
+    """Run the daemon or talk to a running one"""
+    import json
+    from ocd import daemon
+    from ocd.app import get_rules_path
+
+    if args.command == 'serve':
+        daemon.serve(args.rules, args.socket)
+        return 0
+
+    socket_path = args.socket or get_rules_path(args.rules).with_name('ocd.sock')
+    if args.command == 'trigger':
+        response = daemon.request(socket_path, {'command': 'run', 'job': args.job})
+    else:
+        response = daemon.request(socket_path, {'command': 'stats', 'job': args.job})
+    print(json.dumps(response, indent=2))
+    return 0 if response.get('ok') else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
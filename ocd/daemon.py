@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+daemon.py
+Resident mode running jobs on schedules with warm caches.
+
+Jobs are scheduled with an interval in seconds or a cron expression:
+
+    {"name": "downloads", "source": "...", "interval": 300}
+    {"name": "node_modules", "source": "...", "cron": "0 3 * * 0"}
+
+A Unix socket accepts one JSON request per line:
+
+    {"command": "run", "job": "downloads"}
+    {"command": "stats", "job": "downloads"}
+    {"command": "jobs"}
+    {"command": "reload"}
+"""
+import copy
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from ocd import app, JOB_CONCURRENCY, DEVICE_CONCURRENCY
+from ocd.cache import Cache
+from ocd.log import setup_logging
+from ocd.metrics import stats
+from ocd.parallel import blocked_by
+
+# Seconds between checks of the rules file
+RELOAD_INTERVAL = 1.0
+
+CRON_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+
+def _parse_cron_field(field, low, high):
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/')
+            step = int(step)
+            if step < 1:
+                raise ValueError(f'Invalid step in cron field {field}')
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = (int(x) for x in part.split('-'))
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end:
+            raise ValueError(f'Cron field {field} out of range {low}-{high}')
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class Cron:
+    """Five field cron expression: minute hour day month weekday"""
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f'Cron expression needs 5 fields: {expression}')
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = [
+            _parse_cron_field(f, low, high) for f, (low, high) in zip(fields, CRON_RANGES)]
+        # Both 0 and 7 are Sunday
+        self.weekdays = {d % 7 for d in weekdays}
+        self._any_day = fields[2] == '*'
+        self._any_weekday = fields[4] == '*'
+
+    def _day_matches(self, dt):
+        day = dt.day in self.days
+        weekday = (dt.weekday() + 1) % 7 in self.weekdays
+        # Like cron, a restricted day and weekday match if either does
+        if not self._any_day and not self._any_weekday:
+            return day or weekday
+        return day and weekday
+
+    def next(self, after: datetime):
+        """Return the first matching minute after the given time"""
+        dt = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = dt + timedelta(days=366 * 5)
+        while dt < limit:
+            if dt.month not in self.months:
+                dt = (dt.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+            elif dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + timedelta(hours=1)
+            elif dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+            else:
+                return dt
+        raise ValueError(f'Cron expression never matches: {self.expression}')
+
+
+def next_run(job, now):
+    """Return the timestamp of the next scheduled run of a job, None if it only runs on request"""
+    if job.get('cron'):
+        return Cron(job['cron']).next(datetime.fromtimestamp(now)).timestamp()
+    if job.get('interval'):
+        return now + float(job['interval'])
+    return None
+
+
+def _schedule_key(job):
+    return (job.get('interval'), job.get('cron')) if job else None
+
+
+class Daemon:
+    """Runs jobs from a rules file on their schedules
+
+    Rules are only read again when the file's mtime changes, folder listings
+    and destination names are kept in a Cache shared by all runs. Like in
+    run_jobs, a job doesn't start next to a job it overlaps or runs after, and
+    the concurrency limits of the rules apply. Such a job stays due until it can.
+    """
+
+    def __init__(self, rules_path=None, socket_path=None):
+        self.rules_path = app.get_rules_path(rules_path)
+        self.socket_path = Path(socket_path) if socket_path else self.rules_path.with_name('ocd.sock')
+        self.cache = Cache()
+        self.rules = {}
+        self.jobs = {}
+        self.stats = {}
+        self._mtime = None
+        self._bad_mtime = None
+        self._reconfigure = False
+        self._limits = (JOB_CONCURRENCY, DEVICE_CONCURRENCY)
+        self._next = {}
+        self._running = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._server = None
+
+    def load_rules(self, force=False):
+        """Load the rules if the file changed since the last load"""
+        try:
+            mtime = self.rules_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if not force and mtime is not None and mtime in (self._mtime, self._bad_mtime):
+            return False
+
+        try:
+            rules = app.get_rules(self.rules_path)
+            limits = app.get_concurrency(rules)
+            if limits is None:
+                raise ValueError('invalid concurrency limits')
+        except (ValueError, OSError) as e:
+            # Keep running with the previous rules, the file is read again when it changes
+            logging.warning(f'Could not load rules from {self.rules_path}: {e}')
+            self._bad_mtime = mtime
+            return False
+        self._mtime = self.rules_path.stat().st_mtime_ns
+        self._bad_mtime = None
+
+        now = time.time()
+        jobs = {}
+        schedule = {}
+        for job in rules.get('jobs', []):
+            name = job.get('name')
+            if not name:
+                continue
+            try:
+                schedule[name] = next_run(job, now) if job.get('cron') else (now if job.get('interval') else None)
+            except ValueError as e:
+                logging.warning(f'Job {name} has an invalid schedule: {e}')
+                continue
+            jobs[name] = job
+            self.stats.setdefault(name, {'runs': 0, 'errors': 0, 'running': False, 'last_start': None,
+                                         'last_duration': None, 'last_status': None, 'last_error': None})
+
+        with self._lock:
+            # Keep the schedule of jobs whose schedule didn't change
+            self._next = {name: self._next[name]
+                          if name in self._next and _schedule_key(self.jobs.get(name)) == _schedule_key(job)
+                          else schedule[name]
+                          for name, job in jobs.items()}
+            self.rules = rules
+            self.jobs = jobs
+            self._limits = limits
+            self._reconfigure = True
+        self._configure()
+        logging.info(f'Loaded {len(jobs)} jobs from {self.rules_path}')
+        self._wake.set()
+        return True
+
+    def _configure(self):
+        """Apply the logging and metrics settings of the rules once no job is running"""
+        with self._lock:
+            # Jobs can't start while the audit log and metrics are replaced
+            if self._reconfigure and not self._running:
+                self._reconfigure = False
+                setup_logging(self.rules)
+                stats.configure(self.rules.get('metrics'))
+
+    def trigger(self, name):
+        """Start a job in the background, returns False if it's unknown, already running or has to wait"""
+        with self._lock:
+            job = self.jobs.get(name)
+            if job is None or name in self._running:
+                return False
+            reason = blocked_by(job, list(self._running.values()), *self._limits)
+            if reason:
+                logging.debug(f'Job {name} has to wait, {reason}')
+                return False
+            self._running[name] = job
+            self.stats[name]['running'] = True
+            rules = self.rules
+        thread = threading.Thread(target=self._run, args=(name, job, rules), name=f'ocd-{name}', daemon=True)
+        thread.start()
+        return True
+
+    def _run(self, name, job, rules):
+        start = time.time()
+        error = None
+        try:
+            self.cache.begin_run()
+            # run_job fills in defaults on the job it's given
+            app.run_job(rules=rules, cache=self.cache, **copy.deepcopy(job))
+        except Exception as e:
+            logging.exception(f'Job {name} failed')
+            error = str(e)
+        with self._lock:
+            self._running.pop(name, None)
+            job_stats = self.stats[name]
+            job_stats['running'] = False
+            job_stats['runs'] += 1
+            job_stats['last_start'] = start
+            job_stats['last_duration'] = round(time.time() - start, 6)
+            job_stats['last_status'] = 'error' if error else 'ok'
+            job_stats['last_error'] = error
+            if error:
+                job_stats['errors'] += 1
+        # Metrics are totals since the rules were loaded, jobs may overlap
+        stats.report()
+        self._configure()
+        # Jobs waiting for this one get another chance
+        self._wake.set()
+
+    def run_pending(self, now=None):
+        """Trigger all jobs that are due, returns the names of the triggered jobs"""
+        now = now or time.time()
+        with self._lock:
+            due = [name for name, when in self._next.items() if when is not None and when <= now]
+        triggered = []
+        for name in due:
+            started = self.trigger(name)
+            if started:
+                triggered.append(name)
+            with self._lock:
+                if name not in self.jobs or (not started and name not in self._running):
+                    # Has to wait for other jobs, stays due
+                    continue
+                self._next[name] = next_run(self.jobs[name], now)
+        return triggered
+
+    def handle(self, request):
+        """Answer a control request"""
+        command = request.get('command')
+        name = request.get('job')
+        if command == 'run':
+            if name not in self.jobs:
+                return {'ok': False, 'error': f'Unknown job {name}'}
+            started = self.trigger(name)
+            queued = False
+            with self._lock:
+                if not started and name not in self._running:
+                    # Starts as soon as the jobs it waits for are done
+                    self._next[name] = min(self._next.get(name) or time.time(), time.time())
+                    queued = True
+            return {'ok': True, 'started': started, 'queued': queued}
+        elif command == 'stats':
+            with self._lock:
+                if name:
+                    if name not in self.stats:
+                        return {'ok': False, 'error': f'Unknown job {name}'}
+                    return {'ok': True, 'stats': dict(self.stats[name], next_run=self._next.get(name))}
+                return {'ok': True, 'stats': {k: dict(v, next_run=self._next.get(k)) for k, v in self.stats.items()}}
+        elif command == 'jobs':
+            return {'ok': True, 'jobs': sorted(self.jobs)}
+        elif command == 'reload':
+            self.load_rules(force=True)
+            return {'ok': True}
+        return {'ok': False, 'error': f'Unknown command {command}'}
+
+    def start_server(self):
+        """Listen for control requests on the Unix socket in a background thread"""
+        if self.socket_path.exists():
+            self.socket_path.unlink()
+        self._server = _ControlServer(str(self.socket_path), _ControlHandler)
+        self._server.ocd = self
+        os.chmod(self.socket_path, 0o600)
+        threading.Thread(target=self._server.serve_forever, name='ocd-control', daemon=True).start()
+        logging.info(f'Listening on {self.socket_path}')
+
+    def serve_forever(self):
+        """Run scheduled jobs until stopped"""
+        self.load_rules(force=True)
+        self.start_server()
+        try:
+            while not self._stop.is_set():
+                self.load_rules()
+                now = time.time()
+                self.run_pending(now)
+                with self._lock:
+                    # Jobs still due have to wait, they are tried again when a job ends
+                    upcoming = [w for w in self._next.values() if w is not None and w > now]
+                wait = min([RELOAD_INTERVAL] + [w - now for w in upcoming])
+                self._wake.wait(max(wait, 0.01))
+                self._wake.clear()
+        finally:
+            self.close()
+
+    def stop(self, *args):
+        self._stop.set()
+        self._wake.set()
+
+    def close(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            if self.socket_path.exists():
+                self.socket_path.unlink()
+
+
+class _ControlServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class _ControlHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.ocd.handle(json.loads(line))
+            except (ValueError, AttributeError) as e:
+                response = {'ok': False, 'error': str(e)}
+            self.wfile.write((json.dumps(response) + '\n').encode())
+
+
+def request(socket_path, message):
+    """Send a control request to a running daemon and return the response"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(str(socket_path))
+        s.sendall((json.dumps(message) + '\n').encode())
+        with s.makefile('rb') as f:
+            return json.loads(f.readline())
+
+
+def serve(rules_path=None, socket_path=None):
+    """Run the daemon in the foreground until SIGINT or SIGTERM"""
+    daemon = Daemon(rules_path, socket_path)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    daemon.serve_forever()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+log.py
+Logging setup, rate limited progress and the per operation audit log.
+"""
+import atexit
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+
+PROGRESS_INTERVAL = 1.0
+
+_listener = None
+
+
+def setup_logging(rules):
+    """Apply the logging section from rules
+
+    With log_queue enabled in rules the configured handlers are moved to a
+    background thread and records are only put on a queue on the hot path.
+    """
+    global _listener
+    stop_logging()
+
+    # Rules without a logging section get the default one, like before it was configurable
+    import copy
+    from logging.config import dictConfig
+    from ocd import LOGGING_CONFIG
+    dictConfig(copy.deepcopy(rules.get('logging') or LOGGING_CONFIG))
+
+    if rules.get('log_queue'):
+        import queue
+        from logging.handlers import QueueHandler, QueueListener
+        root = logging.getLogger()
+        handlers = list(root.handlers)
+        for handler in handlers:
+            root.removeHandler(handler)
+        records = queue.SimpleQueue()
+        root.addHandler(QueueHandler(records))
+        _listener = QueueListener(records, *handlers, respect_handler_level=True)
+        _listener.start()
+
+    audit.configure(rules.get('audit_log'))
+
+
+def stop_logging():
+    """Flush and stop the background logging thread, handing its handlers back to the root logger"""
+    global _listener
+    if _listener:
+        from logging.handlers import QueueHandler
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            if isinstance(handler, QueueHandler):
+                root.removeHandler(handler)
+        _listener.stop()
+        for handler in _listener.handlers:
+            root.addHandler(handler)
+        _listener = None
+    audit.close()
+
+
+atexit.register(stop_logging)
+
+
+class Progress:
+    """Log progress at most once per interval, with throughput
+
+    Args:
+        prefix: job prefix for the log lines
+        total: number of items that will be processed
+        label: what is being processed
+        interval: minimum number of seconds between log lines
+    """
+
+    def __init__(self, prefix, total, label='files', interval=PROGRESS_INTERVAL):
+        self.prefix = prefix
+        self.total = total
+        self.label = label
+        self.interval = interval
+        self.count = 0
+        self._start = time.perf_counter()
+        self._next = self._start + interval
+
+    def update(self, n=1):
+        self.count += n
+        now = time.perf_counter()
+        if now >= self._next:
+            self._next = now + self.interval
+            self._log(now)
+
+    def done(self):
+        self._log(time.perf_counter())
+
+    def _log(self, now):
+        elapsed = now - self._start
+        rate = self.count / elapsed if elapsed else 0.0
+        logging.info('%s Processed %d of %d %s (%.0f %s/s)',
+                     self.prefix, self.count, self.total, self.label, rate, self.label)
+
+
+class AuditLog:
+    """Append one JSON line per file operation
+
+    Disabled unless a path is configured, records are buffered and only
+    flushed when the log is closed.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._file = None
+        # Jobs running concurrently share the log
+        self._lock = threading.Lock()
+
+    def configure(self, path=None):
+        """Switch to another file, records of running jobs go to either one"""
+        new = None
+        if path:
+            path = Path(path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            new = path.open('a', encoding='utf8', buffering=1024 * 1024)
+        with self._lock:
+            old, self._file = self._file, new
+            self.enabled = new is not None
+            if old:
+                old.close()
+
+    def record(self, job, operation, source, destination=None, result=None):
+        if not self.enabled:
+            return
+        line = json.dumps({'time': time.time(),
+                           'job': job,
+                           'operation': operation,
+                           'source': str(source),
+                           'destination': str(destination) if destination else None,
+                           'result': result},
+                          ensure_ascii=False)
+        with self._lock:
+            # Closed since enabled was checked
+            if self._file:
+                self._file.write(line + '\n')
+
+    def close(self):
+        self.configure(None)
+
+
+audit = AuditLog()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+metrics.py
+Counters and latency histograms for a run of jobs.
+"""
+import json
+import logging
+import math
+import os
+import stat
+import threading
+import time
+from functools import wraps
+from pathlib import Path
+
+# Latency buckets grow by a factor of 2 ** (1 / STEPS) from MIN_LATENCY,
+# which keeps quantiles within ~10% while the histogram stays a fixed size
+MIN_LATENCY = 1e-6
+STEPS = 8
+BUCKETS = 30 * STEPS + 2
+QUANTILES = [0.5, 0.99]
+
+
+class Histogram:
+    """Log bucketed latency histogram"""
+    __slots__ = ('counts', 'count', 'sum', 'max')
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        if seconds <= MIN_LATENCY:
+            i = 0
+        else:
+            i = min(int(math.log2(seconds / MIN_LATENCY) * STEPS) + 1, BUCKETS - 1)
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """Return the upper bound of the bucket holding the given quantile"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(MIN_LATENCY * 2 ** (i / STEPS), self.max)
+        return self.max
+
+
+class Operation:
+    """Totals for a single instrumented operation"""
+    __slots__ = ('latency', 'errors', 'skipped', 'bytes', 'items')
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.errors = 0
+        self.skipped = 0
+        self.bytes = 0
+        self.items = 0
+
+    def summary(self):
+        output = {'count': self.latency.count,
+                  'errors': self.errors,
+                  'skipped': self.skipped,
+                  'bytes': self.bytes,
+                  'items': self.items,
+                  'seconds': round(self.latency.sum, 6),
+                  'max': round(self.latency.max, 6)}
+        for q in QUANTILES:
+            output[f'p{int(q * 100)}'] = round(self.latency.quantile(q), 6)
+        return output
+
+
+class Metrics:
+    """Collects operation counters for a run
+
+    Nothing is recorded unless enabled, the instrumented functions only pay
+    for a single attribute lookup.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.json_path = None
+        self.textfile_path = None
+        self._lock = threading.Lock()
+        self.reset()
+
+    def configure(self, settings=None):
+        """Apply the metrics section from rules.json and start a new run"""
+        settings = settings or {}
+        self.enabled = bool(settings.get('enabled', False))
+        self.json_path = settings.get('json')
+        self.textfile_path = settings.get('textfile')
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.operations = {}
+            self.started = time.time()
+            self._start = time.perf_counter()
+
+    def observe(self, op, seconds, nbytes=0, items=0, error=False, skipped=False):
+        with self._lock:
+            operation = self.operations.get(op)
+            if operation is None:
+                operation = self.operations[op] = Operation()
+            operation.latency.add(seconds)
+            operation.bytes += nbytes
+            operation.items += items
+            if error:
+                operation.errors += 1
+            if skipped:
+                operation.skipped += 1
+
+    def summary(self):
+        """Return all counters as a dict"""
+        with self._lock:
+            return {'started': self.started,
+                    'duration': round(time.perf_counter() - self._start, 6),
+                    'operations': {k: v.summary() for k, v in sorted(self.operations.items())}}
+
+    def report(self):
+        """Log the run summary and write it to the configured files"""
+        if not self.enabled:
+            return None
+        summary = self.summary()
+        logging.info(f'Run metrics: {json.dumps(summary)}')
+        if self.json_path:
+            _write_atomic(Path(self.json_path), json.dumps(summary, indent=2))
+        if self.textfile_path:
+            _write_atomic(Path(self.textfile_path), prometheus_text(summary))
+        return summary
+
+
+def prometheus_text(summary):
+    """Format a summary in the Prometheus text exposition format"""
+    lines = ['# HELP ocd_operation_duration_seconds Latency of ocd operations',
+             '# TYPE ocd_operation_duration_seconds summary']
+    operations = summary['operations']
+    for op, values in operations.items():
+        for q in QUANTILES:
+            lines.append(f'ocd_operation_duration_seconds{{op="{op}",quantile="{q}"}} '
+                         f'{values[f"p{int(q * 100)}"]}')
+        lines.append(f'ocd_operation_duration_seconds_sum{{op="{op}"}} {values["seconds"]}')
+        lines.append(f'ocd_operation_duration_seconds_count{{op="{op}"}} {values["count"]}')
+    for name, key, help_text in [('errors', 'errors', 'Failed ocd operations'),
+                                 ('skipped', 'skipped', 'Skipped ocd operations'),
+                                 ('bytes', 'bytes', 'Bytes handled by ocd operations'),
+                                 ('items', 'items', 'Paths handled by ocd operations')]:
+        lines.append(f'# HELP ocd_operation_{name}_total {help_text}')
+        lines.append(f'# TYPE ocd_operation_{name}_total counter')
+        for op, values in operations.items():
+            lines.append(f'ocd_operation_{name}_total{{op="{op}"}} {values[key]}')
+    lines.append('# HELP ocd_run_duration_seconds Duration of the last run')
+    lines.append('# TYPE ocd_run_duration_seconds gauge')
+    lines.append(f'ocd_run_duration_seconds {summary["duration"]}')
+    lines.append('# HELP ocd_last_run_timestamp_seconds Start time of the last run')
+    lines.append('# TYPE ocd_last_run_timestamp_seconds gauge')
+    lines.append(f'ocd_last_run_timestamp_seconds {summary["started"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def _write_atomic(path: Path, text):
+    # node_exporter may read the file at any time, so never expose a partial write
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f'.{path.name}.tmp')
+    tmp.write_text(text)
+    os.replace(tmp, path)
+
+
+def path_size(path, *args, **kwargs):
+    """Size of the file given as first argument, 0 for folders and missing paths"""
+    try:
+        st = path.stat()
+    except OSError:
+        return 0
+    return st.st_size if stat.S_ISREG(st.st_mode) else 0
+
+
+def result_count(result, *args, **kwargs):
+    """Number of items in the returned list"""
+    return len(result)
+
+
+def paths_count(result, job, paths, *args, **kwargs):
+    """Number of paths handed to an organize function"""
+    return len(paths)
+
+
+stats = Metrics()
+
+
+def timed(op, size=None, items=None, skips=False):
+    """Decorator recording latency, bytes and errors of a function
+
+    Args:
+        op: name of the operation
+        size: function returning the number of bytes from the call arguments
+        items: function returning the number of items from the result and call arguments
+        skips: a result of None means the call was skipped, like a copy to a taken name
+
+    A raised exception or a result of False is counted as an error, skips are
+    counted separately.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not stats.enabled:
+                return func(*args, **kwargs)
+
+            nbytes = size(*args, **kwargs) if size else 0
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                stats.observe(op, time.perf_counter() - start, nbytes, error=True)
+                raise
+            stats.observe(op, time.perf_counter() - start, nbytes,
+                          items=items(result, *args, **kwargs) if items else 0,
+                          error=result is False, skipped=skips and result is None)
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+parallel.py
+Run independent jobs concurrently.
+
+A job waits for every earlier job whose source or destination overlaps its
+own, and for the jobs named in its after attribute:
+
+    {"name": "thumbnails", "source": "...", "after": ["photos"]}
+
+Jobs that don't wait for each other run at the same time, up to the
+concurrency rule in total and device_concurrency per device.
+"""
+import logging
+import os
+from pathlib import Path
+
+
+def job_paths(job, parent=None):
+    """Return the resolved source and destination paths of a job and its sub jobs"""
+    parent = parent or {}
+    source = job.get('source') or parent.get('source')
+    destination = job.get('destination') or parent.get('destination') or source
+    paths = set()
+    for path in [source, destination]:
+        if path:
+            paths.add(Path(path).expanduser().resolve())
+    for j in job.get('jobs') or []:
+        paths.update(job_paths(j, {'source': source, 'destination': destination}))
+    return paths
+
+
+def overlaps(paths_a, paths_b):
+    """Check if any path in one set is equal to or inside a path in the other"""
+    for a in paths_a:
+        for b in paths_b:
+            if a == b or a in b.parents or b in a.parents:
+                return True
+    return False
+
+
+def path_device(path: Path):
+    """Return the device of a path, or of its closest existing parent"""
+    for p in [path, *path.parents]:
+        try:
+            return os.stat(p).st_dev
+        except OSError:
+            continue
+    return None
+
+
+def after_names(job):
+    """Names in the after attribute of a job, which may be a single name"""
+    after = job.get('after') or []
+    return [after] if isinstance(after, str) else list(after)
+
+
+def dependencies(jobs):
+    """Return a list with the set of job indices every job waits for
+
+    Jobs wait for earlier jobs with overlapping paths and for the jobs named
+    in their after attribute.
+    """
+    paths = [job_paths(job) for job in jobs]
+    names = {}
+    for i, job in enumerate(jobs):
+        names.setdefault(job.get('name'), []).append(i)
+
+    output = []
+    for i, job in enumerate(jobs):
+        deps = {j for j in range(i) if overlaps(paths[i], paths[j])}
+        for name in after_names(job):
+            if name not in names:
+                logging.warning(f'Job {job.get("name")} runs after unknown job {name}')
+            deps.update(j for j in names.get(name, []) if j != i)
+        output.append(deps)
+    return output
+
+
+def blocked_by(job, running, concurrency=1, device_concurrency=1):
+    """Return why a job can't start next to the running jobs, None if it can
+
+    Used where jobs start one at a time instead of as a list, like in the
+    daemon: a job doesn't run next to a job whose paths overlap its own or
+    that either of them names in its after attribute.
+    """
+    if len(running) >= concurrency:
+        return 'concurrency limit'
+    paths = job_paths(job)
+    devices = {path_device(p) for p in paths} - {None}
+    in_use = {}
+    for other in running:
+        other_paths = job_paths(other)
+        if (other.get('name') in after_names(job) or job.get('name') in after_names(other)
+                or overlaps(paths, other_paths)):
+            return f'waiting for {other.get("name")}'
+        for d in {path_device(p) for p in other_paths} - {None}:
+            in_use[d] = in_use.get(d, 0) + 1
+    if any(in_use.get(d, 0) >= device_concurrency for d in devices):
+        return 'device limit'
+    return None
+
+
+def find_cycle(deps, pending):
+    """Return the indices of a dependency cycle among the pending jobs, in waiting order, or None"""
+    pending = set(pending)
+    visited = set()
+    for start in sorted(pending):
+        if start in visited:
+            continue
+        # Depth first search keeping the current path on a stack
+        path = [start]
+        on_path = {start}
+        stack = [iter(sorted(deps[start] & pending))]
+        visited.add(start)
+        while stack:
+            j = next(stack[-1], None)
+            if j is None:
+                stack.pop()
+                on_path.discard(path.pop())
+            elif j in on_path:
+                return path[path.index(j):]
+            elif j not in visited:
+                visited.add(j)
+                path.append(j)
+                on_path.add(j)
+                stack.append(iter(sorted(deps[j] & pending)))
+    return None
+
+
+def run_concurrently(jobs, run, concurrency=1, device_concurrency=1):
+    """Run jobs with run(job), independent jobs in parallel
+
+    Args:
+        jobs: list of job dicts
+        run: function running a single job
+        concurrency: maximum number of jobs running at once
+        device_concurrency: maximum number of jobs using a device at once
+    """
+    if concurrency < 1 or device_concurrency < 1:
+        raise ValueError(f'Concurrency limits must be 1 or more, got {concurrency} and {device_concurrency}')
+    if concurrency == 1 or len(jobs) <= 1:
+        for job in jobs:
+            run(job)
+        return
+
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+    deps = dependencies(jobs)
+    devices = [{path_device(p) for p in job_paths(job)} - {None} for job in jobs]
+    in_use = {}
+    pending = list(range(len(jobs)))
+    done = set()
+    running = {}
+    error = None
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='ocd-job') as executor:
+        while pending or running:
+            # Start ready jobs in list order while there's room
+            if error is None:
+                for i in list(pending):
+                    if len(running) >= concurrency:
+                        break
+                    if deps[i] - done:
+                        continue
+                    if any(in_use.get(d, 0) >= device_concurrency for d in devices[i]):
+                        continue
+                    pending.remove(i)
+                    for d in devices[i]:
+                        in_use[d] = in_use.get(d, 0) + 1
+                    running[executor.submit(run, jobs[i])] = i
+
+                if not running and pending:
+                    # Only a cycle in the after attributes gets here, the job of
+                    # the cycle that comes first stops waiting for the next one
+                    cycle = find_cycle(deps, pending)
+                    if cycle is None:
+                        raise RuntimeError(f'None of the {len(pending)} remaining jobs can start')
+                    names = ' -> '.join(str(jobs[j].get('name')) for j in cycle + cycle[:1])
+                    logging.warning(f'Jobs wait for each other in a cycle {names}, '
+                                    f'running {jobs[min(cycle)].get("name")} first')
+                    position = cycle.index(min(cycle))
+                    deps[cycle[position]].discard(cycle[(position + 1) % len(cycle)])
+                    continue
+            elif not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                i = running.pop(future)
+                done.add(i)
+                for d in devices[i]:
+                    in_use[d] -= 1
+                if future.exception() is not None and error is None:
+                    # Like running in sequence, no new jobs start after a failure
+                    error = future.exception()
+
+    if error is not None:
+        raise error
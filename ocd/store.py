@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+store.py
+Compact columnar storage for scanned entries and planned operations.
+
+Folders are interned in a table, names are kept in a single bytes buffer and
+everything else in typed arrays, so an entry costs tens of bytes instead of
+the hundreds a Path object and a dict do. Path objects are only made when
+entries are read.
+"""
+import os
+import sys
+from array import array
+from pathlib import Path
+
+# Names are stored the way os.fsencode encodes them
+ENCODING = sys.getfilesystemencoding()
+ERRORS = sys.getfilesystemencodeerrors()
+
+# Entry kinds, symlinks are resolved when asked for files or folders
+FILE = 0
+DIR = 1
+LINK = 2
+OTHER = 3
+
+
+def entry_kind(entry):
+    """Kind of an os.DirEntry without following symlinks"""
+    if entry.is_symlink():
+        return LINK
+    if entry.is_dir(follow_symlinks=False):
+        return DIR
+    if entry.is_file(follow_symlinks=False):
+        return FILE
+    return OTHER
+
+
+def entry_items(paths):
+    """Yield (folder, name, size, mtime) tuples from Entries or a list of Path objects"""
+    if isinstance(paths, Entries):
+        yield from paths.items()
+        return
+    for path in paths:
+        yield os.fspath(path.parent), path.name, -1, -1
+
+
+class Table:
+    """Interned strings with integer ids"""
+    __slots__ = ('values', '_ids', '_paths')
+
+    def __init__(self):
+        self.values = []
+        self._ids = {}
+        self._paths = {}
+
+    def id(self, value):
+        i = self._ids.get(value)
+        if i is None:
+            i = self._ids[value] = len(self.values)
+            self.values.append(value)
+        return i
+
+    def path(self, i):
+        """Path object for an id, made once per id"""
+        path = self._paths.get(i)
+        if path is None:
+            path = self._paths[i] = Path(self.values[i])
+        return path
+
+    def __len__(self):
+        return len(self.values)
+
+
+class _Names:
+    """Variable length strings in one buffer"""
+    __slots__ = ('_buffer', '_offsets')
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._offsets = array('Q', [0])
+
+    def append(self, name):
+        self._buffer += name.encode(ENCODING, ERRORS)
+        self._offsets.append(len(self._buffer))
+
+    def __getitem__(self, i):
+        return str(self._buffer[self._offsets[i]:self._offsets[i + 1]], ENCODING, ERRORS)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+
+class Entries:
+    """Scanned paths with their kind, size and mtime
+
+    Iterating yields Path objects, items() yields plain folder and name strings.
+    A size or mtime of -1 means it wasn't looked up during the scan.
+    """
+
+    def __init__(self, dirs=None):
+        self.dirs = dirs if dirs is not None else Table()
+        self.names = _Names()
+        self.dir = array('I')
+        self.kind = array('B')
+        self.size = array('q')
+        self.mtime = array('q')
+
+    def append(self, folder, name, kind=FILE, size=-1, mtime=-1):
+        self.dir.append(self.dirs.id(os.fspath(folder)))
+        self.names.append(name)
+        self.kind.append(kind)
+        self.size.append(size)
+        self.mtime.append(mtime)
+
+    def path(self, i):
+        return self.dirs.path(self.dir[i]) / self.names[i]
+
+    def items(self):
+        """Yield (folder, name, size, mtime) tuples without making Path objects"""
+        values = self.dirs.values
+        for i in range(len(self)):
+            yield values[self.dir[i]], self.names[i], self.size[i], self.mtime[i]
+
+    def _select(self, kind):
+        # Shares the folder table, symlinks are resolved with a stat
+        output = Entries(self.dirs)
+        for i in range(len(self)):
+            k = self.kind[i]
+            if k == LINK:
+                path = self.path(i)
+                if (kind == FILE and path.is_file()) or (kind == DIR and path.is_dir()):
+                    k = kind
+            if k == kind:
+                output.append(self.dirs.values[self.dir[i]], self.names[i], kind, self.size[i], self.mtime[i])
+        return output
+
+    def files(self):
+        """Entries that are files or symlinks to files"""
+        return self._select(FILE)
+
+    def folders(self):
+        """Entries that are folders or symlinks to folders"""
+        return self._select(DIR)
+
+    def __getitem__(self, i):
+        return self.path(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.path(i)
+
+    def __len__(self):
+        return len(self.dir)
+
+
+class Plan:
+    """Planned operations: source, destination, size, mtime, operation and group
+
+    Iterating yields (source, destination) Path tuples.
+    """
+
+    def __init__(self, operations=None, dirs=None):
+        self.dirs = dirs if dirs is not None else Table()
+        self.groups = Table()
+        self.operations = Table()
+        for op in operations or []:
+            self.operations.id(op)
+        self.groups.id(None)
+        self.names = _Names()
+        self.source_dir = array('I')
+        self.destination_dir = array('I')
+        self.size = array('q')
+        self.mtime = array('q')
+        self.op = array('B')
+        self.group = array('H')
+
+    def append(self, source_dir, source_name, destination_dir, destination_name, size=-1, mtime=-1,
+               op=None, group=None):
+        """Add an operation, folders are given as strings or paths"""
+        self.source_dir.append(self.dirs.id(os.fspath(source_dir)))
+        self.destination_dir.append(self.dirs.id(os.fspath(destination_dir)))
+        # Destination names are stored even when equal, the buffer is cheap
+        self.names.append(source_name)
+        self.names.append(destination_name)
+        self.size.append(size)
+        self.mtime.append(mtime)
+        self.op.append(self.operations.id(op))
+        self.group.append(self.groups.id(group))
+
+    def source(self, i):
+        return self.dirs.path(self.source_dir[i]) / self.names[2 * i]
+
+    def destination(self, i):
+        return self.dirs.path(self.destination_dir[i]) / self.names[2 * i + 1]
+
+    def operation(self, i):
+        return self.operations.values[self.op[i]]
+
+    def group_name(self, i):
+        return self.groups.values[self.group[i]]
+
+    def sources(self):
+        """Yield the source paths in plan order"""
+        for i in range(len(self)):
+            yield self.source(i)
+
+    def destination_dirs(self):
+        """Set of destination folders as Path objects"""
+        return {self.dirs.path(i) for i in set(self.destination_dir)}
+
+    def __getitem__(self, i):
+        return self.source(i), self.destination(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.source(i), self.destination(i)
+
+    def __len__(self):
+        return len(self.source_dir)
@@ -5,13 +5,29 @@ script_name.py
 Description of script_name.py.
 """
 import logging
+import logging.handlers
 import json
 import shutil
 import string
 import random
+import contextlib
+import io
+import os
+import time
+import threading
+from datetime import datetime
 from unittest import TestCase
 from pathlib import Path
 from ocd import DEFAULT_RULES
+from ocd import metrics
+from ocd import log
+from ocd import bench
+from ocd import cli
+from ocd import daemon
+from ocd import store
+from ocd import order
+from ocd import parallel
+from ocd.cache import Cache
 import app as ocd
 
 
@@ -137,7 +153,34 @@ class TestOperations(TestCase):
         shutil.rmtree(self.source)
 
     def test_copy(self):
-        self.fail()
+        source = self.source / 'a.txt'
+        destination = self.source / 'copies' / 'document' / 'a.txt'
+        self.assertTrue(ocd.copy(source, destination))
+        self.assertEqual('a.txt', destination.read_text())
+        self.assertTrue(source.exists())
+        self.assertFalse(ocd.copy(source, destination))
+
+        # A destination the caller knows is taken isn't checked again
+        self.assertFalse(ocd.copy(self.source / 'b.txt', destination.with_name('b.txt'), exists=True))
+        self.assertFalse(destination.with_name('b.txt').exists())
+
+        # A wrong answer from the caller never overwrites a file, copies and moves are skipped
+        taken = destination.with_name('c.txt')
+        taken.write_text('user data')
+        self.assertIsNone(ocd.copy(self.source / 'c.txt', taken, exists=False))
+        self.assertIsNone(ocd.move(self.source / 'c.txt', taken, exists=False))
+        self.assertEqual('user data', taken.read_text())
+        self.assertTrue((self.source / 'c.txt').exists())
+        self.assertEqual([], list(taken.parent.glob('.*.part')))
+
+        # Names close to the filesystem limit still fit with the temporary suffix
+        long_name = self.source / ('l' * 250 + '.txt')
+        long_name.write_text('long')
+        destination = self.source / 'copies' / long_name.name
+        self.assertTrue(ocd.copy(long_name, destination))
+        self.assertEqual('long', destination.read_text())
+        self.assertEqual([destination], list(destination.parent.glob('*' + long_name.suffix)))
+        self.assertEqual([], list(destination.parent.glob('.*.part')))
 
     def test_get_paths(self):
         files = ocd.get_paths(self.source)
@@ -205,6 +248,127 @@ class TestHelpers(TestCase):
         self.assertTrue(ocd.verify_checksums(file_a, file_c))
         self.assertFalse(ocd.verify_checksums(file_a, file_b))
 
+    def test_tree_checksum(self):
+        file_a = self.test_path / 'file_a'
+        file_a.write_bytes(b'abcdefghij')
+
+        checksum = ocd.get_checksum(file_a, chunk_size=4)
+        self.assertTrue(checksum.startswith('tree-'))
+        self.assertEqual(4, ocd.checksum_chunk_size(checksum))
+        self.assertEqual(0, ocd.checksum_chunk_size(ocd.get_checksum(file_a)))
+        self.assertNotEqual(checksum, ocd.get_checksum(file_a, chunk_size=3))
+
+        # The hash of the chunk hashes
+        name, new = ocd._hash_function()
+        root = new()
+        for chunk in [b'abcd', b'efgh', b'ij']:
+            root.update(new(chunk).digest())
+        self.assertEqual(f'tree-{name}-4:{root.hexdigest()}', checksum)
+
+        # Files that can't be memory mapped are read in the same chunks
+        import mmap
+
+        def unmappable(*args, **kwargs):
+            raise OSError('mmap not supported')
+
+        mmap_type, pread = mmap.mmap, os.pread
+        mmap.mmap = unmappable
+        try:
+            self.assertEqual(checksum, ocd.get_checksum(file_a, chunk_size=4))
+            del os.pread
+            self.assertEqual(checksum, ocd.get_checksum(file_a, chunk_size=4))
+        finally:
+            mmap.mmap, os.pread = mmap_type, pread
+
+        # Files above the threshold are compared with the scheme of the first one
+        file_b = self.test_path / 'file_b'
+        file_b.write_bytes(b'abcdefghij')
+        large_file = ocd.HASH_LARGE_FILE
+        ocd.HASH_LARGE_FILE = 8
+        try:
+            self.assertTrue(ocd.get_checksum(file_a).startswith('tree-'))
+            self.assertTrue(ocd.verify_checksums(file_a, file_b))
+        finally:
+            ocd.HASH_LARGE_FILE = large_file
+
+    def test_link(self):
+        file_a = self.test_path / 'file_a'
+        file_a.write_text('a')
+
+        link_a = self.test_path / 'group' / 'file_a'
+        self.assertTrue(ocd.link(file_a, link_a))
+        self.assertFalse(link_a.is_symlink())
+        self.assertTrue(file_a.samefile(link_a))
+
+        # Never replace an existing file
+        self.assertFalse(ocd.link(file_a, link_a))
+
+    def test_durability(self):
+        sources = []
+        for name in ['a', 'b', 'c']:
+            source = self.test_path / f'{name}.txt'
+            source.write_text(name)
+            sources.append(source)
+        destination = self.test_path / 'moved'
+
+        # Sources are deleted when the batch is synced
+        batch = ocd.SyncBatch(size=2)
+        for source in sources:
+            self.assertTrue(ocd.move(source, destination / source.name, durability='batch', batch=batch))
+        self.assertEqual([False, False, True], [s.exists() for s in sources])
+        batch.close()
+        self.assertFalse(any(s.exists() for s in sources))
+        self.assertEqual(['a.txt', 'b.txt', 'c.txt'], sorted(p.name for p in destination.iterdir()))
+
+        # No temporary files are left behind
+        self.assertTrue(ocd.copy(destination / 'a.txt', self.test_path / 'copy' / 'a.txt', durability='file'))
+        self.assertEqual(['a.txt'], [p.name for p in (self.test_path / 'copy').iterdir()])
+        self.assertIsNone(ocd.get_job_attributes({'name': 'test', 'source': self.test_path, 'durability': 'all'}))
+
+        # A failing move still completes the batch of the ones before it
+        source = self.test_path / 'batch'
+        source.mkdir()
+        for name in ['a', 'b']:
+            (source / f'{name}.txt').write_text(name)
+        job = ocd.get_job_attributes({'name': 'test', 'source': source, 'destination': self.test_path / 'out',
+                                      'durability': 'batch'})
+        copy_file = ocd._copy_file
+
+        def failing(source, destination, fsync=False):
+            if source.name == 'b.txt':
+                raise OSError('disk full')
+            return copy_file(source, destination, fsync)
+
+        ocd._copy_file = failing
+        try:
+            self.assertRaises(OSError, ocd.organize_files, job, sorted(source.iterdir()), DEFAULT_RULES)
+        finally:
+            ocd._copy_file = copy_file
+        self.assertEqual(['b.txt'], [p.name for p in source.iterdir()])
+        self.assertTrue((self.test_path / 'out' / 'document' / 'a.txt').is_file())
+
+    def test_make_dirs(self):
+        root = self.test_path / 'organized'
+        paths = [root / 'picture', root / 'video', root / 'a' / 'b', root]
+        dirs = ocd.make_dirs(paths, root, workers=2)
+        self.assertEqual(set(paths) | {root / 'a'}, dirs)
+        for path in paths:
+            self.assertTrue(path.is_dir())
+
+        # Known folders aren't created again
+        ocd.make_dir(root / 'missing', {root / 'missing'})
+        self.assertFalse((root / 'missing').exists())
+
+    def test_symlink(self):
+        file_a = self.test_path / 'file_a'
+        file_a.write_text('a')
+
+        link_a = self.test_path / 'group' / 'file_a'
+        self.assertTrue(ocd.symlink(file_a, link_a))
+        self.assertTrue(link_a.is_symlink())
+        self.assertEqual('a', link_a.read_text())
+        self.assertFalse(ocd.symlink(file_a, link_a))
+
     def test_remove_characters(self):
         illegal_name = r'>" (greater than):'
         legal_name = ' (greater than)'
@@ -235,6 +399,642 @@ class TestHelpers(TestCase):
             self.assertTrue(i in string.ascii_letters)
 
 
+class TestArchive(TestCase):
+    def setUp(self) -> None:
+        self.source = Path(__file__).parent / '_test_archive_source'
+        self.destination = Path(__file__).parent / '_test_archive_destination'
+        for d in string.ascii_letters[:4]:
+            p = self.source / d
+            p.mkdir(parents=True, exist_ok=True)
+            for n in range(8):
+                f = p / f'{d}{n}.txt'
+                f.write_text(d * 100)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.source)
+        if self.destination.is_dir():
+            shutil.rmtree(self.destination)
+
+    def test_archive(self):
+        files = sorted(self.source.rglob('*.txt'))
+        bundles = ocd.archive(files, self.destination, 'document', root=self.source, max_size=1000)
+
+        # 32 files of 100 bytes with a 1000 byte cap
+        self.assertEqual(4, len(bundles))
+        for bundle in bundles:
+            self.assertTrue(bundle.is_file())
+            self.assertTrue(ocd.index_path(bundle).is_file())
+
+        # Numbering continues instead of overwriting
+        added = []
+        more = ocd.archive(files[:1], self.destination, 'document', root=self.source,
+                           added=lambda path, bundle: added.append((path, bundle)))
+        self.assertEqual('document_0005.tar', more[0].name)
+        self.assertEqual([(files[0], more[0])], added)
+
+    def test_archive_files(self):
+        audit_path = self.destination / 'audit.jsonl'
+        self.destination.mkdir()
+        log.audit.configure(audit_path)
+        try:
+            job = ocd.get_job_attributes({'name': 'test', 'source': self.source, 'destination': self.destination,
+                                          'operation': 'archive', 'subdirs': True, 'archive_size': 1000})
+            files = sorted(self.source.rglob('*.txt'))
+            plan = ocd.plan_archive(job, files, DEFAULT_RULES)
+            ocd.archive_files(job, files, DEFAULT_RULES)
+        finally:
+            log.audit.close()
+
+        # One record per archived file, pointing at the bundle the plan listed
+        lines = [json.loads(x) for x in audit_path.read_text().splitlines()]
+        self.assertEqual(32, len(lines))
+        self.assertTrue(all(x['operation'] == 'archive' and x['result'] for x in lines))
+        self.assertTrue(all(Path(x['destination']).is_file() for x in lines))
+        self.assertEqual(plan, [(Path(x['source']), Path(x['destination'])) for x in lines])
+        self.assertEqual(4, len({bundle for _, bundle in plan}))
+        self.assertTrue(all(f.exists() for f in files))
+
+    def test_extract(self):
+        files = sorted(self.source.rglob('*.txt'))
+        for compression in ['none', 'gz']:
+            bundles = ocd.archive(files, self.destination, compression, root=self.source, compression=compression)
+            self.assertEqual(1, len(bundles))
+            self.assertTrue(ocd.is_archive(bundles[0]))
+
+            output = self.destination / f'{compression}_output'
+            ocd.extract(bundles[0], output)
+            result = sorted(x.relative_to(output) for x in output.rglob('*.txt'))
+            self.assertEqual(sorted(x.relative_to(self.source) for x in files), result)
+            self.assertEqual('a' * 100, (output / 'a' / 'a0.txt').read_text())
+
+    def test_find_in_archives(self):
+        files = sorted(self.source.rglob('*.txt'))
+        bundles = ocd.archive(files, self.destination, 'document', root=self.source, max_size=1000)
+        found = ocd.find_in_archives(self.destination, 'd7.txt')
+        self.assertEqual(1, len(found))
+        self.assertEqual(bundles[-1], found[0][0])
+        self.assertEqual('d/d7.txt', found[0][1]['name'])
+
+
+class TestMetrics(TestCase):
+    def setUp(self) -> None:
+        self.test_path = Path(__file__).parent / '_test_metrics'
+        self.test_path.mkdir(parents=True, exist_ok=True)
+
+    def tearDown(self) -> None:
+        metrics.stats.configure()
+        shutil.rmtree(self.test_path)
+
+    def test_disabled(self):
+        metrics.stats.configure()
+        ocd.get_paths(self.test_path)
+        self.assertEqual({}, metrics.stats.summary()['operations'])
+        self.assertIsNone(metrics.stats.report())
+
+    def test_report(self):
+        json_path = self.test_path / 'metrics.json'
+        textfile_path = self.test_path / 'ocd.prom'
+        metrics.stats.configure({'enabled': True, 'json': str(json_path), 'textfile': str(textfile_path)})
+
+        file_a = self.test_path / 'file_a'
+        file_a.write_text('a' * 10)
+        ocd.get_checksum(file_a)
+        ocd.get_checksum(file_a)
+        ocd.get_paths(self.test_path)
+        summary = metrics.stats.report()
+
+        self.assertEqual(2, summary['operations']['get_checksum']['count'])
+        self.assertEqual(20, summary['operations']['get_checksum']['bytes'])
+        self.assertEqual(1, summary['operations']['get_paths']['items'])
+        self.assertEqual(summary, json.loads(json_path.read_text()))
+        self.assertIn('ocd_operation_duration_seconds_count{op="get_checksum"} 2', textfile_path.read_text())
+
+        # A taken destination is a skip, not an error
+        metrics.stats.reset()
+        self.assertTrue(ocd.copy(file_a, self.test_path / 'copy' / 'file_a'))
+        self.assertIsNone(ocd.copy(file_a, self.test_path / 'copy' / 'file_a'))
+        copies = metrics.stats.summary()['operations']['copy']
+        self.assertEqual((2, 0, 1), (copies['count'], copies['errors'], copies['skipped']))
+
+    def test_histogram(self):
+        histogram = metrics.Histogram()
+        for i in range(1, 101):
+            histogram.add(i / 1000)
+        self.assertAlmostEqual(0.05, histogram.quantile(0.5), delta=0.005)
+        self.assertAlmostEqual(0.099, histogram.quantile(0.99), delta=0.01)
+        self.assertEqual(0.1, histogram.quantile(1.0))
+
+
+class TestLog(TestCase):
+    def setUp(self) -> None:
+        self.test_path = Path(__file__).parent / '_test_log'
+        self.test_path.mkdir(parents=True, exist_ok=True)
+
+    def tearDown(self) -> None:
+        log.audit.close()
+        shutil.rmtree(self.test_path)
+
+    def test_progress(self):
+        progress = log.Progress('[test]', 1000, interval=3600)
+        with self.assertLogs(level=logging.INFO) as logs:
+            for i in range(1000):
+                progress.update()
+            progress.done()
+        self.assertEqual(1, len(logs.records))
+        self.assertIn('Processed 1000 of 1000 files', logs.output[0])
+
+    def test_audit(self):
+        audit_path = self.test_path / 'audit.jsonl'
+        log.audit.configure(audit_path)
+        log.audit.record('job', 'copy', Path('a'), Path('b'), True)
+        log.audit.record('job', 'delete', Path('c'))
+        log.audit.close()
+
+        lines = [json.loads(x) for x in audit_path.read_text().splitlines()]
+        self.assertEqual(2, len(lines))
+        self.assertEqual('b', lines[0]['destination'])
+        self.assertTrue(lines[0]['result'])
+        self.assertIsNone(lines[1]['destination'])
+
+        # Nothing is written when disabled
+        log.audit.record('job', 'copy', Path('a'), Path('b'), True)
+        self.assertEqual(2, len(audit_path.read_text().splitlines()))
+
+        # A record racing with close is dropped quietly instead of failing the job
+        log.audit.enabled = True
+        log.audit.record('job', 'copy', Path('a'), Path('b'), True)
+        log.audit.enabled = False
+
+    def test_default_config(self):
+        # Rules without a logging section still log at INFO
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        log.setup_logging({})
+        self.assertEqual(logging.INFO, root.level)
+        self.assertTrue(any(isinstance(h, logging.StreamHandler) for h in root.handlers))
+        log.stop_logging()
+
+    def test_queue(self):
+        rules = {'logging': DEFAULT_RULES['logging'], 'log_queue': True}
+        log.setup_logging(rules)
+        root = logging.getLogger()
+        self.assertTrue(any(isinstance(h, logging.handlers.QueueHandler) for h in root.handlers))
+        log.stop_logging()
+        self.assertFalse(any(isinstance(h, logging.handlers.QueueHandler) for h in root.handlers))
+        self.assertTrue(root.handlers)
+
+
+class TestBench(TestCase):
+    def test_run(self):
+        report = bench.run(files=50, depth=2, width=2, repeat=1, operations=['dryrun', 'move'], startup=False,
+                           memory_entries=0)
+        names = [r['name'] for r in report['results']]
+        self.assertIn('get_paths', names)
+        self.assertIn('organize_files[dryrun]', names)
+        self.assertIn('organize_files[move]', names)
+        self.assertIn('organize_folders[delete]', names)
+        for r in report['results']:
+            self.assertNotIn('error', r)
+            self.assertGreater(r['seconds'], 0)
+
+        speedups = bench.compare(report, report)
+        self.assertEqual(1.0, speedups['get_paths'])
+
+    def test_memory(self):
+        paths, store = bench.bench_memory(2000, depth=2, width=2)
+        self.assertGreater(store['reduction'], 3)
+        self.assertLess(store['bytes_per_entry'], paths['bytes_per_entry'])
+
+    def test_parse_importtime(self):
+        text = ('import time: self [us] | cumulative | imported package\n'
+                'import time:       100 |        100 |   _json\n'
+                'import time:       200 |        300 | json\n'
+                'import time:      1000 |       1000 | ocd\n')
+        self.assertEqual({'json': 0.0003, 'ocd': 0.001}, bench.parse_importtime(text))
+
+    def test_generate_tree(self):
+        root = Path(__file__).parent / '_test_bench'
+        try:
+            paths_a, size_a = bench.generate_tree(root / 'a', files=20, seed=1)
+            paths_b, size_b = bench.generate_tree(root / 'b', files=20, seed=1)
+            self.assertEqual(size_a, size_b)
+            self.assertEqual([p.relative_to(root / 'a') for p in paths_a],
+                             [p.relative_to(root / 'b') for p in paths_b])
+        finally:
+            shutil.rmtree(root)
+
+
+class TestCli(TestCase):
+    def setUp(self) -> None:
+        self.test_path = Path(__file__).parent / '_test_cli'
+        self.source = self.test_path / 'source'
+        self.source.mkdir(parents=True, exist_ok=True)
+        (self.source / 'a b.txt').write_text('a')
+        (self.source / 'c.jpg').write_text('c')
+        self.rules_path = self.test_path / 'rules.json'
+        ocd._write_rules(self.rules_path, dict(DEFAULT_RULES, jobs=[
+            {'name': 'first', 'source': str(self.source), 'destination': str(self.test_path / 'out'),
+             'target': 'files', 'jobs': [{'name': 'sub', 'operation': 'copy'}]},
+            {'name': 'second', 'source': str(self.source), 'operation': 'copy'}]))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.test_path)
+
+    def test_select_jobs(self):
+        rules = ocd._load_rules(self.rules_path)
+        args = cli.build_parser().parse_args(['run', '-j', 'second'])
+        self.assertEqual(['second'], [j['name'] for j in cli.select_jobs(rules, args)])
+
+        args = cli.build_parser().parse_args(['run', str(self.source), '-d', 'out', '-s'])
+        jobs = cli.select_jobs(rules, args)
+        self.assertEqual([{'name': 'cli', 'source': str(self.source), 'destination': 'out', 'subdirs': True}], jobs)
+
+    def test_force_operation(self):
+        rules = ocd._load_rules(self.rules_path)
+        job = cli.force_operation(rules['jobs'][0], 'dryrun')
+        self.assertEqual('dryrun', job['operation'])
+        self.assertEqual('dryrun', job['jobs'][0]['operation'])
+        self.assertEqual('copy', rules['jobs'][0]['jobs'][0]['operation'])
+
+    def test_plan(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            cli.main(['plan', '--rules', str(self.rules_path), '-j', 'first'])
+        lines = sorted(output.getvalue().splitlines())
+        out = self.test_path / 'out'
+        self.assertEqual(sorted([f'copy\t{self.source / "a b.txt"}\t{out / "document" / "a_b.txt"}',
+                                 f'copy\t{self.source / "c.jpg"}\t{out / "picture" / "c.jpg"}',
+                                 f'move\t{self.source / "a b.txt"}\t{out / "document" / "a_b.txt"}',
+                                 f'move\t{self.source / "c.jpg"}\t{out / "picture" / "c.jpg"}']), lines)
+        # Nothing was changed
+        self.assertFalse(out.exists())
+
+    def test_dryrun(self):
+        cli.main(['dryrun', '--rules', str(self.rules_path)])
+        self.assertEqual(['a b.txt', 'c.jpg'], sorted(x.name for x in self.source.iterdir()))
+        self.assertFalse((self.test_path / 'out').exists())
+
+
+class TestCache(TestCase):
+    def setUp(self) -> None:
+        self.test_path = Path(__file__).parent / '_test_cache'
+        self.test_path.mkdir(parents=True, exist_ok=True)
+        (self.test_path / 'a.txt').write_text('a')
+        (self.test_path / 'sub').mkdir()
+        # Old enough to be cached
+        os.utime(self.test_path, (time.time() - 60, time.time() - 60))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.test_path)
+
+    def test_list_dir(self):
+        cache = Cache()
+        self.assertEqual([('a.txt', store.FILE), ('sub', store.DIR)], sorted(cache.list_dir(self.test_path)))
+        self.assertEqual(1, len(cache))
+
+        # A new entry changes the folder mtime
+        (self.test_path / 'b.txt').write_text('b')
+        self.assertIn(('b.txt', store.FILE), cache.list_dir(self.test_path))
+
+    def test_get_paths(self):
+        cache = Cache()
+        paths = ocd.get_paths(self.test_path, subdirs=True, cache=cache)
+        self.assertEqual(sorted(ocd.get_paths(self.test_path, subdirs=True)), sorted(paths))
+
+    def test_stale_destination(self):
+        source = self.test_path / 'src'
+        source.mkdir()
+        (source / 'b.txt').write_text('source')
+        destination = self.test_path / 'dst'
+        (destination / 'document').mkdir(parents=True)
+
+        # The listing is checked once per run, a file written since then isn't in it
+        cache = Cache()
+        self.assertFalse(cache.exists(destination / 'document' / 'b.txt'))
+        (destination / 'document' / 'b.txt').write_text('user data')
+        for operation in ['copy', 'move']:
+            job = ocd.get_job_attributes({'name': 'test', 'source': source, 'destination': destination,
+                                          'operation': operation})
+            ocd.organize_files(job, [source / 'b.txt'], DEFAULT_RULES, cache=cache)
+            self.assertEqual('user data', (destination / 'document' / 'b.txt').read_text())
+            self.assertTrue((source / 'b.txt').exists())
+        self.assertTrue(cache.exists(destination / 'document' / 'b.txt'))
+
+    def test_exists(self):
+        cache = Cache()
+        self.assertTrue(cache.exists(self.test_path / 'a.txt'))
+        self.assertFalse(cache.exists(self.test_path / 'b.txt'))
+        self.assertFalse(cache.exists(self.test_path / 'missing' / 'b.txt'))
+
+        (self.test_path / 'b.txt').write_text('b')
+        cache.add(self.test_path / 'b.txt')
+        self.assertTrue(cache.exists(self.test_path / 'b.txt'))
+        (self.test_path / 'a.txt').unlink()
+        cache.discard(self.test_path / 'a.txt')
+        self.assertFalse(cache.exists(self.test_path / 'a.txt'))
+
+        # Changes by others are picked up by the next run
+        (self.test_path / 'c.txt').write_text('c')
+        self.assertFalse(cache.exists(self.test_path / 'c.txt'))
+        cache.begin_run()
+        self.assertTrue(cache.exists(self.test_path / 'c.txt'))
+        self.assertTrue(cache.exists(self.test_path / 'b.txt'))
+
+
+class TestStore(TestCase):
+    def setUp(self) -> None:
+        self.test_path = Path(__file__).parent / '_test_store'
+        self.test_path.mkdir(exist_ok=True)
+        (self.test_path / 'a.txt').write_text('a')
+        (self.test_path / 'sub').mkdir()
+        (self.test_path / 'sub' / 'b.jpg').write_text('b')
+        (self.test_path / 'link').symlink_to(self.test_path / 'sub')
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.test_path)
+
+    def test_entries(self):
+        entries = store.Entries()
+        entries.append('/a', 'ö.txt', size=3)
+        entries.append('/a', 'b.txt')
+        entries.append('/b', 'c', store.DIR)
+        self.assertEqual(3, len(entries))
+        self.assertEqual(2, len(entries.dirs))
+        self.assertEqual([Path('/a/ö.txt'), Path('/a/b.txt'), Path('/b/c')], list(entries))
+        self.assertEqual(('/a', 'ö.txt', 3, -1), next(entries.items()))
+
+    def test_scan(self):
+        entries = ocd.scan(self.test_path, subdirs=True)
+        self.assertEqual(sorted(ocd.get_paths(self.test_path, subdirs=True)), sorted(entries))
+        # Symlinked folders count as folders but aren't walked into
+        self.assertEqual([self.test_path / 'a.txt', self.test_path / 'sub' / 'b.jpg'], sorted(entries.files()))
+        self.assertEqual([self.test_path / 'link', self.test_path / 'sub'], sorted(entries.folders()))
+
+    def test_filters(self):
+        (self.test_path / 'big.txt').write_bytes(b'x' * 2048)
+        day = 24 * 3600
+        os.utime(self.test_path / 'a.txt', (time.time() - 2 * day, time.time() - 2 * day))
+
+        def names(**filters):
+            job = ocd.get_job_attributes(dict(filters, name='test', source=self.test_path))
+            entries = ocd.scan(self.test_path, subdirs=True, stat_filter=ocd.compile_filter(job))
+            return sorted(p.name for p in entries.files())
+
+        self.assertIsNone(ocd.compile_filter({}))
+        self.assertEqual(['big.txt'], names(min_size='1K'))
+        self.assertEqual(['a.txt', 'b.jpg'], names(max_size=1024))
+        self.assertEqual(['a.txt'], names(older_than='1d'))
+        self.assertEqual(['b.jpg', 'big.txt'], names(newer_than='1d'))
+        self.assertEqual(['a.txt', 'b.jpg', 'big.txt'], names(owner=os.getuid()))
+        self.assertEqual([], names(owner=os.getuid() + 1))
+
+        # Statted entries keep their size and mtime
+        entries = ocd.scan(self.test_path, pattern='big.txt', stat_filter=ocd.compile_filter({'min_size': 1}))
+        self.assertEqual(2048, entries.size[0])
+
+        self.assertEqual(1536, ocd.parse_size('1.5k'))
+        self.assertEqual(1024 ** 3, ocd.parse_size('1GB'))
+        self.assertEqual(100, ocd.parse_size('100b'))
+        self.assertEqual(100, ocd.parse_size('100 B'))
+        self.assertRaises(ValueError, ocd.parse_age, '2b')
+        self.assertEqual(2 * 3600, ocd.parse_age('2h'))
+        self.assertRaises(ValueError, ocd.parse_size, 'lots')
+        self.assertIsNone(ocd.get_job_attributes({'name': 'test', 'source': self.test_path, 'older_than': 'soon'}))
+
+    def test_plan(self):
+        job = ocd.get_job_attributes({'name': 'test', 'source': self.test_path, 'destination': '/dst'})
+        files = ocd.scan(self.test_path, subdirs=True).files()
+        plan = ocd.plan_files(job, files, DEFAULT_RULES)
+        self.assertEqual(list(plan), list(ocd.plan_files(job, list(files), DEFAULT_RULES)))
+        self.assertEqual((self.test_path / 'sub' / 'b.jpg', Path('/dst/picture/b.jpg')), plan[1])
+        self.assertEqual('picture', plan.group_name(1))
+        self.assertEqual('move', plan.operation(1))
+        self.assertEqual({Path('/dst/document'), Path('/dst/picture')}, plan.destination_dirs())
+
+
+class TestOrder(TestCase):
+    def setUp(self) -> None:
+        self.test_path = Path(__file__).parent / '_test_order'
+        self.test_path.mkdir(exist_ok=True)
+        self.paths = []
+        for i in range(5):
+            path = self.test_path / f'{4 - i}.txt'
+            path.write_text(str(i) * 100)
+            self.paths.append(path)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.test_path)
+
+    def test_read_order(self):
+        self.assertEqual([0, 1, 2, 3, 4], order.read_order(self.paths))
+        inodes = [p.stat().st_ino for p in self.paths]
+        self.assertEqual(sorted(inodes), [inodes[i] for i in order.read_order(self.paths, 'inode')])
+        # Physical order falls back to inode order where FIEMAP isn't supported
+        self.assertEqual([0, 1, 2, 3, 4], sorted(order.read_order(iter(self.paths), 'physical')))
+
+    def test_get_checksums(self):
+        checksums = ocd.get_checksums(self.paths, 'physical')
+        self.assertEqual({p: ocd.get_checksum(p) for p in self.paths}, checksums)
+
+    def test_read_order_attribute(self):
+        job = {'name': 'test', 'source': self.test_path, 'read_order': 'random'}
+        self.assertIsNone(ocd.get_job_attributes(job))
+
+
+class TestParallel(TestCase):
+    def test_dependencies(self):
+        jobs = [{'name': 'downloads', 'source': '/data/downloads', 'destination': '/data/sorted'},
+                {'name': 'photos', 'source': '/data/sorted/picture', 'destination': '/photos'},
+                {'name': 'modules', 'source': '/code', 'jobs': [{'name': 'sub', 'destination': '/photos/x'}]},
+                {'name': 'other', 'source': '/other', 'after': 'downloads'},
+                {'name': 'cycle', 'source': '/cycle', 'after': ['cycle', 'unknown']}]
+        self.assertEqual([set(), {0}, {1}, {0}, set()], parallel.dependencies(jobs))
+
+        # Only a job inside the cycle stops waiting, x still waits for c1
+        jobs = [{'name': 'x', 'source': '/x', 'after': 'c1'},
+                {'name': 'c1', 'source': '/c1', 'after': 'c2'},
+                {'name': 'c2', 'source': '/c2', 'after': 'c1'}]
+        deps = parallel.dependencies(jobs)
+        self.assertEqual([{1}, {2}, {1}], deps)
+        self.assertEqual([1, 2], parallel.find_cycle(deps, [0, 1, 2]))
+        self.assertIsNone(parallel.find_cycle(deps, [0, 1]))
+        order = []
+        with self.assertLogs(level='WARNING') as logs:
+            parallel.run_concurrently(jobs, lambda job: order.append(job['name']), concurrency=2)
+        self.assertEqual('c1', order[0])
+        self.assertEqual({'c2', 'x'}, set(order[1:]))
+        self.assertEqual(1, len(logs.output))
+        self.assertIn('c1 -> c2 -> c1', logs.output[0])
+
+    def test_blocked_by(self):
+        a = {'name': 'a', 'source': '/data/a'}
+        b = {'name': 'b', 'source': '/data/b'}
+        self.assertIsNone(parallel.blocked_by(b, [a], concurrency=2, device_concurrency=2))
+        self.assertEqual('concurrency limit', parallel.blocked_by(b, [a], concurrency=1, device_concurrency=2))
+        self.assertEqual('device limit', parallel.blocked_by(b, [a], concurrency=2, device_concurrency=1))
+        self.assertEqual('waiting for a', parallel.blocked_by({'name': 'c', 'source': '/data/a/c'}, [a], 2, 2))
+        self.assertEqual('waiting for a', parallel.blocked_by(dict(b, after='a'), [a], 2, 2))
+
+    def test_run_concurrently(self):
+        events = []
+        lock = threading.Lock()
+
+        def run(job):
+            with lock:
+                events.append(('start', job['name']))
+            time.sleep(0.2)
+            with lock:
+                events.append(('end', job['name']))
+
+        root = Path(__file__).parent
+        jobs = [{'name': 'a', 'source': str(root / 'a')},
+                {'name': 'b', 'source': str(root / 'b')},
+                {'name': 'c', 'source': str(root / 'a' / 'c')}]
+        start = time.time()
+        parallel.run_concurrently(jobs, run, concurrency=4, device_concurrency=4)
+        # a and b run together, c waits for a
+        self.assertLess(time.time() - start, 0.55)
+        self.assertLess(events.index(('end', 'a')), events.index(('start', 'c')))
+        self.assertEqual({('start', 'a'), ('start', 'b')}, set(events[:2]))
+
+        # One job per device at a time
+        events.clear()
+        parallel.run_concurrently(jobs[:2], run, concurrency=4, device_concurrency=1)
+        self.assertEqual(['start', 'end', 'start', 'end'], [e[0] for e in events])
+
+    def test_failure(self):
+        def run(job):
+            if job['name'] == 'a':
+                raise OSError('failed')
+
+        jobs = [{'name': 'a', 'source': '/a'}, {'name': 'b', 'source': '/a/b'}]
+        self.assertRaises(OSError, parallel.run_concurrently, jobs, run, concurrency=2)
+
+    def test_limits(self):
+        jobs = [{'name': 'a', 'source': '/a'}, {'name': 'b', 'source': '/b'}]
+        self.assertRaises(ValueError, parallel.run_concurrently, jobs, print, concurrency=2, device_concurrency=0)
+        self.assertEqual((4, 1), ocd.get_concurrency({}))
+        for limits in [{'device_concurrency': 0}, {'concurrency': -1}, {'concurrency': '2'}]:
+            self.assertIsNone(ocd.get_concurrency(limits))
+
+
+class TestDaemon(TestCase):
+    def setUp(self) -> None:
+        self.test_path = Path(__file__).parent / '_test_daemon'
+        self.source = self.test_path / 'source'
+        self.source.mkdir(parents=True, exist_ok=True)
+        (self.source / 'a.txt').write_text('a')
+        self.rules_path = self.test_path / 'rules.json'
+        ocd._write_rules(self.rules_path, dict(DEFAULT_RULES, jobs=[
+            {'name': 'sort', 'source': str(self.source), 'destination': str(self.test_path / 'out'),
+             'target': 'files', 'interval': 3600},
+            {'name': 'nightly', 'source': str(self.source), 'operation': 'dryrun', 'cron': '0 3 * * *'}]))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.test_path)
+
+    def test_cron(self):
+        cron = daemon.Cron('*/15 3 * * *')
+        self.assertEqual(datetime(2024, 1, 1, 3, 0), cron.next(datetime(2024, 1, 1, 2, 30)))
+        self.assertEqual(datetime(2024, 1, 1, 3, 15), cron.next(datetime(2024, 1, 1, 3, 0)))
+        self.assertEqual(datetime(2024, 1, 2, 3, 0), cron.next(datetime(2024, 1, 1, 3, 45)))
+
+        # Sundays at 04:30, both 0 and 7 mean Sunday
+        for expression in ['30 4 * * 0', '30 4 * * 7']:
+            self.assertEqual(datetime(2024, 1, 7, 4, 30), daemon.Cron(expression).next(datetime(2024, 1, 1)))
+
+        self.assertEqual(datetime(2024, 3, 1, 0, 0), daemon.Cron('0 0 1 3 *').next(datetime(2024, 1, 15)))
+        self.assertRaises(ValueError, daemon.Cron, '* * *')
+        self.assertRaises(ValueError, daemon.Cron, '61 * * * *')
+
+    def _wait(self, ocd_daemon, name):
+        for i in range(100):
+            if ocd_daemon.stats[name]['runs']:
+                return
+            time.sleep(0.05)
+
+    def test_schedule(self):
+        ocd_daemon = daemon.Daemon(self.rules_path, self.test_path / 'ocd.sock')
+        self.assertTrue(ocd_daemon.load_rules())
+        self.assertFalse(ocd_daemon.load_rules())
+        self.assertEqual(['nightly', 'sort'], sorted(ocd_daemon.jobs))
+
+        # Interval jobs run right away, cron jobs wait for their time
+        self.assertEqual(['sort'], ocd_daemon.run_pending())
+        self._wait(ocd_daemon, 'sort')
+        self.assertEqual('ok', ocd_daemon.stats['sort']['last_status'])
+        self.assertTrue((self.test_path / 'out' / 'document' / 'a.txt').is_file())
+        self.assertEqual([], ocd_daemon.run_pending())
+
+    def test_bad_rules(self):
+        ocd_daemon = daemon.Daemon(self.rules_path, self.test_path / 'ocd.sock')
+        ocd_daemon.load_rules()
+
+        # A half written rules file keeps the previous jobs
+        self.rules_path.write_text('{"jobs": [')
+        os.utime(self.rules_path, ns=(time.time_ns() + 10 ** 9, time.time_ns() + 10 ** 9))
+        self.assertFalse(ocd_daemon.load_rules())
+        self.assertEqual(['nightly', 'sort'], sorted(ocd_daemon.jobs))
+        self.assertEqual(['sort'], ocd_daemon.run_pending())
+        self._wait(ocd_daemon, 'sort')
+
+        # Fixing the file loads it again
+        ocd._write_rules(self.rules_path, dict(DEFAULT_RULES, jobs=[{'name': 'only', 'source': str(self.source)}]))
+        os.utime(self.rules_path, ns=(time.time_ns() + 2 * 10 ** 9, time.time_ns() + 2 * 10 ** 9))
+        self.assertTrue(ocd_daemon.load_rules())
+        self.assertEqual(['only'], sorted(ocd_daemon.jobs))
+
+    def test_wait(self):
+        ocd_daemon = daemon.Daemon(self.rules_path, self.test_path / 'ocd.sock')
+        ocd_daemon.load_rules()
+
+        # Both jobs sort the same folder, neither starts while the other runs
+        ocd_daemon._running['nightly'] = ocd_daemon.jobs['nightly']
+        self.assertEqual([], ocd_daemon.run_pending())
+        self.assertLessEqual(ocd_daemon._next['sort'], time.time())
+        response = ocd_daemon.handle({'command': 'run', 'job': 'sort'})
+        self.assertEqual((False, True), (response['started'], response['queued']))
+
+        del ocd_daemon._running['nightly']
+        self.assertEqual(['sort'], ocd_daemon.run_pending())
+        self._wait(ocd_daemon, 'sort')
+        self.assertGreater(ocd_daemon._next['sort'], time.time())
+
+    def test_reload_while_running(self):
+        ocd_daemon = daemon.Daemon(self.rules_path, self.test_path / 'ocd.sock')
+        ocd_daemon.load_rules()
+        audit_path = self.test_path / 'audit.jsonl'
+        try:
+            # The audit log isn't switched under a running job
+            ocd_daemon._running['nightly'] = ocd_daemon.jobs['nightly']
+            ocd._write_rules(self.rules_path, dict(ocd_daemon.rules, audit_log=str(audit_path)))
+            self.assertTrue(ocd_daemon.load_rules(force=True))
+            self.assertFalse(log.audit.enabled)
+
+            del ocd_daemon._running['nightly']
+            ocd_daemon._configure()
+            self.assertTrue(log.audit.enabled)
+        finally:
+            log.audit.close()
+
+    def test_control(self):
+        ocd_daemon = daemon.Daemon(self.rules_path, self.test_path / 'ocd.sock')
+        ocd_daemon.load_rules()
+        ocd_daemon.start_server()
+        try:
+            self.assertEqual(['nightly', 'sort'], daemon.request(ocd_daemon.socket_path, {'command': 'jobs'})['jobs'])
+            response = daemon.request(ocd_daemon.socket_path, {'command': 'run', 'job': 'nightly'})
+            self.assertTrue(response['started'])
+            self._wait(ocd_daemon, 'nightly')
+            response = daemon.request(ocd_daemon.socket_path, {'command': 'stats', 'job': 'nightly'})
+            self.assertEqual(1, response['stats']['runs'])
+            self.assertFalse(daemon.request(ocd_daemon.socket_path, {'command': 'run', 'job': 'nope'})['ok'])
+        finally:
+            ocd_daemon.close()
+        self.assertFalse(ocd_daemon.socket_path.exists())
+
+
 class TestJobs(TestCase):
     def test_run_jobs(self):
         ocd.run_jobs()